@@ -1,14 +1,22 @@
 import os
 import re
+import sys
 import json
+import time
+import random
+import hashlib
+import html as html_lib
+from functools import lru_cache
+from types import SimpleNamespace
 from http.server import BaseHTTPRequestHandler
-from openai import OpenAI
+
+# NOTE: the openai SDK (pydantic + httpx) is imported lazily in make_client() to keep cold starts short.
 
 OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL")
 OPENAI_ORG_ID = os.environ.get("OPENAI_ORG_ID")
 
-# Unwrap code fences if the provider adds them.
-FENCE_RE = re.compile(r"^\s*```(?:html|xml|markdown)?\s*([\s\S]*?)\s*```\s*$", re.IGNORECASE)
+# Unwrap code fences if the provider adds them (language tag after the opening fence).
+FENCE_LANG_RE = re.compile(r"(?:html|xml|markdown)?", re.IGNORECASE)
 
 # Detect which tool is invoking us (based on the HTML prompt banner)
 IS_VOCAB_RE = re.compile(r"FCS\s+VOCABULARY\s+OUTPUT", re.IGNORECASE)
@@ -24,6 +32,16 @@ TOPIC_RE = re.compile(r"<title>\s*Vocabulary\s*[—-]\s*(.*?)\s*</title>", re.IG
 # Parse selected sections (from the prompt HTML comment line: "INCLUDE SECTIONS: nouns,verbs,...")
 SECTIONS_RE = re.compile(r"INCLUDE\s+SECTIONS?\s*:\s*([a-z,\s]+)", re.IGNORECASE)
 
+# (selection key, count key, section title regex, plain title) for every counted, resizable section
+_RESIZABLE_SECTIONS = [
+    ('nouns', 'n', r"Nouns", "Nouns"),
+    ('verbs', 'v', r"Verbs\s+in\s+Sentences", "Verbs in Sentences"),
+    ('adjectives', 'a', r"Adjectives", "Adjectives"),
+    ('adverbs', 'd', r"Adverbs", "Adverbs"),
+    ('phrases', 'phr_rows', r"Common\s+Phrases", "Common Phrases"),
+    ('questions', 'q_rows', r"Common\s+Questions", "Common Questions"),
+]
+
 
 def parse_vocab_range(prompt_text: str):
     m = RANGE_RE.search(prompt_text or "")
@@ -38,7 +56,7 @@ def parse_vocab_range(prompt_text: str):
 def parse_topic(prompt_text: str) -> str:
     m = TOPIC_RE.search(prompt_text or "")
     if m:
-        return re.sub(r"\s+", " ", m.group(1)).strip()
+        return WS_RE.sub(" ", m.group(1)).strip()
     return "Topic"
 
 
@@ -135,6 +153,36 @@ def phrases_questions_row_targets(total_vocab_midpoint: int):
 # -----------------------
 # Guidance (verbatim block you provided)
 # -----------------------
+class VocabTargets:
+    """
+    What a Vocabulary prompt asks for: range, selected sections, NVAD quotas and Common rows [min, max].
+    Every step (system contract, size estimate, verification, repair, resize, bank, cache) reads these.
+    """
+    __slots__ = ("lo", "hi", "selected", "selected_nvda", "target_total", "quotas", "rows_minmax")
+
+    def __init__(self, lo: int, hi: int, selected: set):
+        self.lo, self.hi, self.selected = lo, hi, selected
+        self.selected_nvda = {s for s in selected if s in {'nouns', 'verbs', 'adjectives', 'adverbs'}}
+        self.target_total = midpoint(lo, hi) if self.selected_nvda else 0
+        self.quotas = quotas_by_selection(self.target_total, self.selected_nvda)
+        pmin, _ = phrases_questions_row_targets(self.target_total)
+        self.rows_minmax = (max(8, pmin), 10)
+
+
+def vocab_targets(prompt: str):
+    """
+    VocabTargets for a Vocabulary prompt with a range, else None.
+    A missing bound takes the value of the other one.
+    """
+    if not IS_VOCAB_RE.search(prompt or ""):
+        return None
+    lo, hi = parse_vocab_range(prompt)
+    lo, hi = lo if lo is not None else hi, hi if hi is not None else lo
+    if lo is None:
+        return None
+    return VocabTargets(lo, hi, parse_selected_sections(prompt))
+
+
 def build_user_guidance_prompt(topic: str, lo: int, hi: int) -> str:
     return f"""You are an expert assistant for the FCS program.
  You must always follow every instruction below exactly.
@@ -335,31 +383,21 @@ def build_system_message(base_system: str, user_prompt: str) -> str:
       - color rules + feminine parenthetical handling
       - quotas/range from UI override any conflicting guidance
     """
-    if not IS_VOCAB_RE.search(user_prompt or ""):
+    targets = vocab_targets(user_prompt)
+    if not targets:
         return base_system
 
-    lo, hi = parse_vocab_range(user_prompt)
-    if lo is None and hi is None:
-        return base_system
-
-    # Fallbacks in case only one bound parsed
-    if lo is None: lo = hi
-    if hi is None: hi = lo
-
+    lo, hi = targets.lo, targets.hi
     topic = parse_topic(user_prompt)
-    selected = parse_selected_sections(user_prompt)
-    selected_nvda = {s for s in selected if s in {'nouns', 'verbs', 'adjectives', 'adverbs'}}
+    selected = targets.selected
+    selected_nvda = targets.selected_nvda
     selected_phr = 'phrases' in selected
     selected_q = 'questions' in selected
 
-    target_total = midpoint(lo, hi) if selected_nvda else 0
-    if selected_nvda:
-        quotas_map = quotas_by_selection(target_total, selected_nvda)
-        n, v, a, d = quotas_map['n'], quotas_map['v'], quotas_map['a'], quotas_map['d']
-    else:
-        n = v = a = d = 0
+    target_total = targets.target_total
+    n, v, a, d = targets.quotas['n'], targets.quotas['v'], targets.quotas['a'], targets.quotas['d']
 
-    phrases_min, questions_min = phrases_questions_row_targets(target_total)
+    phrases_min = questions_min = targets.rows_minmax[0]
     max_reuse = max(1, (target_total * 20 + 99) // 100) if target_total > 0 else 1
 
     guidance = build_user_guidance_prompt(topic, lo, hi)
@@ -432,33 +470,532 @@ STRICT ONE-SHOT COUNTING CONTRACT (Vocabulary ONLY; do NOT change UI/format), RE
     return base_system + contract
 
 
+# -----------------------
+# Model routing (per task type, with fallback chain and per-route stats)
+# -----------------------
+
+# Task types: "full" = whole document (first generation, or a full regeneration when a section is
+# missing), "repair" = single-section repairs (count top-ups, conversation/monologue retries),
+# "small" = tiny jobs (Common-only selections, small ranges, small resize deltas).
+ROUTE_TYPES = ("full", "repair", "small")
+SMALL_JOB_MAX_ITEMS = int(os.getenv("SMALL_JOB_MAX_ITEMS", "40"))
+
+# Warm instances keep these between requests: {route: {model: {...}}}
+ROUTE_STATS = {}
+
+
+def load_model_routes():
+    """
+    Read MODEL_ROUTES (JSON) into {route: {"models": [...], "max_tokens": int|None}}.
+    Each route value may be a list of models or {"models": [...], "max_tokens": N}.
+    Unset routes use OPENAI_MODEL followed by OPENAI_FALLBACK_MODELS (comma separated).
+    """
+    default_chain = [os.getenv("OPENAI_MODEL", "gpt-4o")]
+    default_chain += [m.strip() for m in os.getenv("OPENAI_FALLBACK_MODELS", "").split(",") if m.strip()]
+    try:
+        configured = json.loads(os.getenv("MODEL_ROUTES") or "{}")
+    except json.JSONDecodeError:
+        print("MODEL_ROUTES is not valid JSON; using default routing.")
+        configured = {}
+    if not isinstance(configured, dict):
+        print("MODEL_ROUTES must be a JSON object of route -> models; using default routing.")
+        configured = {}
+
+    routes = {}
+    for route in ROUTE_TYPES:
+        cfg = configured.get(route)
+        if isinstance(cfg, list):
+            cfg = {"models": cfg}
+        cfg = cfg if isinstance(cfg, dict) else {}
+        models = [m for m in (cfg.get("models") or []) if isinstance(m, str) and m.strip()]
+        max_tok = cfg.get("max_tokens")
+        routes[route] = {
+            "models": models or list(default_chain),
+            "max_tokens": int(max_tok) if max_tok else None,
+        }
+    return routes
+
+
+# Parsed once per instance (environment variables do not change while it is warm)
+MODEL_ROUTES = load_model_routes()
+
+
+def classify_task(targets, repair: bool = False) -> str:
+    """Route for a Vocabulary job: "repair" for single-section fixes, else "small" or "full" by size."""
+    if repair:
+        return "repair"
+    if not targets.selected_nvda or targets.target_total <= SMALL_JOB_MAX_ITEMS:
+        return "small"
+    return "full"
+
+
+def _record_route_stat(route: str, model: str, ok: bool, elapsed_ms: float, usage=None):
+    st = ROUTE_STATS.setdefault(route, {}).setdefault(model, {
+        "calls": 0, "errors": 0, "latency_ms_total": 0.0, "ok_latency_ms_total": 0.0,
+        "prompt_tokens": 0, "completion_tokens": 0,
+    })
+    st["calls"] += 1
+    st["latency_ms_total"] += elapsed_ms
+    if ok:
+        st["ok_latency_ms_total"] += elapsed_ms  # throughput is tokens over the time of calls that produced them
+    else:
+        st["errors"] += 1
+    if usage is not None:
+        st["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        st["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+
+def route_stats_snapshot():
+    out = {}
+    for route, models in ROUTE_STATS.items():
+        out[route] = {}
+        for model, st in models.items():
+            ok_calls = max(1, st["calls"] - st["errors"])
+            out[route][model] = dict(st, avg_latency_ms=round(st["latency_ms_total"] / max(1, st["calls"]), 1),
+                                     avg_completion_tokens=round(st["completion_tokens"] / ok_calls, 1))
+    return out
+
+
+class ModelCallError(Exception):
+    """Upstream model call failed on the direct HTTP path (counts as a fallback-able error)."""
+
+
+def _to_namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _to_namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_to_namespace(v) for v in value]
+    return value
+
+
+class DirectChatClient:
+    """
+    Minimal chat-completions client over urllib (OPENAI_HTTP_MODE=direct).
+    Mirrors the small SDK surface used here: with_options(...).chat.completions.create(...).
+    Responses are plain namespaces, so choices[0].message.content / finish_reason / usage work unchanged.
+    Like the SDK, 408/409/429/5xx and connection errors are retried max_retries times (default 2)
+    with exponential backoff, honouring Retry-After.
+    """
+
+    RETRY_STATUSES = (408, 409, 429)
+    MAX_BACKOFF_S = 8.0
+
+    def __init__(self, api_key: str, base_url=None, organization=None, timeout: float = 120.0, max_retries: int = 2):
+        self.api_key = api_key
+        self.base_url = (base_url or "https://api.openai.com/v1").rstrip("/")
+        self.organization = organization
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.chat = SimpleNamespace(completions=self)
+
+    def with_options(self, timeout=None, max_retries=None):
+        return DirectChatClient(self.api_key, self.base_url, self.organization, timeout or self.timeout,
+                                self.max_retries if max_retries is None else max_retries)
+
+    def _backoff_s(self, attempt: int, retry_after=None) -> float:
+        try:
+            if retry_after is not None:
+                return min(self.MAX_BACKOFF_S, max(0.0, float(retry_after)))
+        except ValueError:
+            pass  # an HTTP date; fall back to the exponential delay
+        return min(self.MAX_BACKOFF_S, 0.5 * 2 ** attempt) * (0.75 + random.random() / 4)
+
+    def create(self, **body):
+        import urllib.error
+        import urllib.request
+
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        data = json.dumps(body).encode("utf-8")
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            req = urllib.request.Request(f"{self.base_url}/chat/completions", data=data, headers=headers, method="POST")
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                    return _to_namespace(json.loads(resp.read().decode("utf-8")))
+            except urllib.error.HTTPError as e:
+                if last or not (e.code in self.RETRY_STATUSES or e.code >= 500):
+                    raise ModelCallError(f"HTTP {e.code}: {e.read()[:300].decode('utf-8', 'replace')}")
+                delay = self._backoff_s(attempt, e.headers.get("Retry-After"))
+            except (urllib.error.URLError, OSError) as e:
+                if last:
+                    raise ModelCallError(str(e))
+                delay = self._backoff_s(attempt)
+            except ValueError as e:  # not JSON: a broken reply, not a transient error
+                raise ModelCallError(str(e))
+            print(f"Model call failed (attempt {attempt + 1}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def make_client(api_key: str):
+    """SDK client by default; OPENAI_HTTP_MODE=direct skips importing openai/pydantic/httpx entirely."""
+    if os.getenv("OPENAI_HTTP_MODE", "sdk").strip().lower() == "direct":
+        return DirectChatClient(api_key, OPENAI_BASE_URL or None, OPENAI_ORG_ID or None)
+    from openai import OpenAI
+    return OpenAI(
+        api_key=api_key,
+        base_url=OPENAI_BASE_URL or None,
+        organization=OPENAI_ORG_ID or None,
+    )
+
+
+def _model_call_errors():
+    errors = [ModelCallError]
+    openai_mod = sys.modules.get("openai")
+    if openai_mod is not None:
+        errors.append(openai_mod.OpenAIError)
+    return tuple(errors)
+
+
+def routed_completion(client, route: str, messages, temperature: float, max_tokens: int):
+    """
+    Call chat completions using the model chain configured for 'route'.
+    A model that errors or times out falls through to the next one; the last error is re-raised.
+    """
+    cfg = MODEL_ROUTES[route]
+    if cfg["max_tokens"]:
+        max_tokens = min(max_tokens, cfg["max_tokens"])
+    timeout = float(os.getenv("MODEL_TIMEOUT_S", "120"))
+    chain = cfg["models"]
+    last_err = None
+    for i, model in enumerate(chain):
+        # Either client retries transient errors itself, but only on the last model: earlier ones fall through
+        opts = {"timeout": timeout} if i == len(chain) - 1 else {"timeout": timeout, "max_retries": 0}
+        started = time.perf_counter()
+        try:
+            completion = client.with_options(**opts).chat.completions.create(
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                messages=messages,
+            )
+        except _model_call_errors() as e:
+            _record_route_stat(route, model, False, (time.perf_counter() - started) * 1000)
+            print(f"Model {model} failed on route '{route}': {e}")
+            last_err = e
+            continue
+        _record_route_stat(route, model, True, (time.perf_counter() - started) * 1000, getattr(completion, "usage", None))
+        return completion
+    raise last_err
+
+
+# -----------------------
+# Output-size prediction (adaptive max_tokens + upfront time estimate)
+# -----------------------
+
+# completion_tokens ≈ base + Σ coef × items, per NVAD quota and Common-section row target.
+# Defaults are rough; fit real coefficients from SIZE_SAMPLE log lines with scripts/fit_size_model.py
+# and deploy them as SIZE_MODEL (JSON). Warm instances also rescale by the observed actual/predicted ratio.
+SIZE_FEATURES = ("n", "v", "a", "d", "phr_rows", "q_rows")
+SIZE_MODEL_DEFAULT = {"base": 900.0, "n": 30.0, "v": 55.0, "a": 50.0, "d": 55.0, "phr_rows": 45.0, "q_rows": 45.0}
+SIZE_HEADROOM = float(os.getenv("SIZE_HEADROOM", "1.3"))
+SIZE_MIN_SAMPLES = 5
+MIN_MAX_TOKENS = int(os.getenv("MODEL_MIN_MAX_TOKENS", "1500"))
+DEFAULT_TOKENS_PER_S = float(os.getenv("MODEL_TOKENS_PER_S", "60"))
+
+# Warm instances keep these between requests
+SIZE_STATS = {"samples": 0, "predicted": 0.0, "actual": 0.0}
+
+
+def load_size_model():
+    """SIZE_MODEL (JSON of coefficient -> value) over the defaults; unknown keys and non-numbers are ignored."""
+    coefs = dict(SIZE_MODEL_DEFAULT)
+    try:
+        configured = json.loads(os.getenv("SIZE_MODEL") or "{}")
+    except json.JSONDecodeError:
+        print("SIZE_MODEL is not valid JSON; using default size model.")
+        configured = {}
+    for k, v in (configured.items() if isinstance(configured, dict) else ()):
+        if k in coefs and isinstance(v, (int, float)):
+            coefs[k] = float(v)
+    return coefs
+
+
+# Parsed once per instance, like MODEL_ROUTES
+SIZE_MODEL = load_size_model()
+
+
+def size_features(targets):
+    """Item counts the model is asked to produce, from the same targets verification uses."""
+    feats = dict(targets.quotas)
+    feats["phr_rows"] = targets.rows_minmax[0] if 'phrases' in targets.selected else 0
+    feats["q_rows"] = targets.rows_minmax[0] if 'questions' in targets.selected else 0
+    return feats
+
+
+def _size_calibration() -> float:
+    if SIZE_STATS["samples"] < SIZE_MIN_SAMPLES or not SIZE_STATS["predicted"]:
+        return 1.0
+    return max(0.5, min(2.0, SIZE_STATS["actual"] / SIZE_STATS["predicted"]))
+
+
+def predict_completion_tokens(features: dict, calibrated: bool = True) -> int:
+    raw = SIZE_MODEL["base"] + sum(SIZE_MODEL[k] * features.get(k, 0) for k in SIZE_FEATURES)
+    return int(round(raw * (_size_calibration() if calibrated else 1.0)))
+
+
+def adaptive_max_tokens(predicted_tokens: int, cap: int) -> int:
+    """Reserve the prediction plus headroom; a miss is recovered by continuation, not regeneration."""
+    return max(min(MIN_MAX_TOKENS, cap), min(cap, int(predicted_tokens * SIZE_HEADROOM)))
+
+
+def observed_tokens_per_s(route: str) -> float:
+    """Throughput of the route's primary model on this instance, or the configured default."""
+    model = MODEL_ROUTES[route]["models"][0]
+    st = ROUTE_STATS.get(route, {}).get(model)
+    if st and st["completion_tokens"] and st["ok_latency_ms_total"]:
+        return st["completion_tokens"] / (st["ok_latency_ms_total"] / 1000)
+    return DEFAULT_TOKENS_PER_S
+
+
+def size_model_snapshot():
+    """What a client needs to estimate generation time itself: coefficients, calibration, throughput."""
+    return dict(SIZE_MODEL, calibration=round(_size_calibration(), 3), samples=SIZE_STATS["samples"],
+                tokens_per_s={route: round(observed_tokens_per_s(route), 1) for route in ("full", "small")},
+                small_job_max_items=SMALL_JOB_MAX_ITEMS)
+
+
+def estimate_generation(prompt: str, cap: int):
+    """
+    {"route", "features", "predicted_tokens", "max_tokens", "estimated_seconds"} for a Vocabulary
+    prompt with a range; None otherwise (callers keep the fixed cap).
+    """
+    targets = vocab_targets(prompt)
+    if not targets:
+        return None
+    route = classify_task(targets)
+    features = size_features(targets)
+    predicted = predict_completion_tokens(features)
+    return {
+        "route": route,
+        "features": features,
+        "predicted_tokens": predicted,
+        "max_tokens": adaptive_max_tokens(predicted, cap),
+        "estimated_seconds": round(predicted / observed_tokens_per_s(route), 1),
+    }
+
+
+def record_size_sample(estimate: dict, completion_tokens: int):
+    """Feed actual usage back into the calibration and log it for offline refitting."""
+    if not estimate or not completion_tokens:
+        return
+    SIZE_STATS["samples"] += 1
+    SIZE_STATS["predicted"] += predict_completion_tokens(estimate["features"], calibrated=False)
+    SIZE_STATS["actual"] += completion_tokens
+    print("SIZE_SAMPLE " + json.dumps({"features": estimate["features"], "completion_tokens": completion_tokens,
+                                       "predicted_tokens": estimate["predicted_tokens"]}))
+
+
 # -----------------------
 # Post-processing helpers (STRICTLY color normalization; do not change section structure)
 # -----------------------
 
 _VOWEL_MAP = str.maketrans("áéíóúÁÉÍÓÚ", "aeiouAEIOU")
 
+# All fixed patterns are compiled once at import; title patterns are compiled once per title.
+# Every pattern that runs over model output is bounded by the next '<', anchored, or starts only
+# at a word start, so a truncated or malformed document is scanned in linear time; no lazy '.*?'
+# spans across tags. Code fences are unwrapped by slicing, not by a pattern over the body.
+_I = re.IGNORECASE
+WS_RE = re.compile(r"\s+")
+TAG_RE = re.compile(r'<[^<>]+>')
+ES_SPAN_RE = re.compile(r'<span\s+class="es">([^<]+)</span>', _I)
+ES_SPAN_OPEN_RE = re.compile(r'<span\s+class="es">', _I)
+EN_GOING_TO_RE = re.compile(r'<span\s+class="en">\s*(is|are)\s+going\s+to\s*</span>', _I)
+
+NOUN_EN_RE = re.compile(r'\b(the)\s+([A-Za-zÁÉÍÓÚÜÑáéíóúüñ\-]+)', _I)
+NOUN_PAREN_RE = re.compile(r'\([^()]*\)')
+# A complete span pair with plain text inside; a lone open or close tag is never matched
+SPAN_PAIR_RE = re.compile(r'<span\b[^<>]*>([^<]*)</span>', _I)
+NOUN_ART_RE = re.compile(r'\b(el|la|los|las)\s+([a-záéíóúüñ/]+)', _I)
+NOUN_FIRST_WORD_RE = re.compile(r'>(\s*)([A-Za-zÁÉÍÓÚÜÑáéíóúüñ/]+)', _I)
+
+VERB_AUX_RE = re.compile(r'(voy|vas|va|vamos|vais|van)\s+a\s+([a-záéíóúüñ]+(?:se)?)', _I)
+VERB_AUX_INF_RE = re.compile(r'\b(voy|vas|va|vamos|vais|van)\s+a\s+([a-záéíóúüñ/]+)\b', _I)
+VERB_SPAN_AUX_RE = re.compile(r'<span\s+class="es">\s*(voy|vas|va|vamos|vais|van)\s+a\s+([a-záéíóúüñ/]+)\s*</span>', _I)
+VERB_SPAN_VA_A_RE = re.compile(r'<span\s+class="es">\s*(va\s*a)\s*</span>', _I)
+# Word patterns start only at a word start, so a long letter run not followed by </td> is tried once
+VERB_LAST_WORD_RE = re.compile(r'(?<![A-Za-zÁÉÍÓÚÜÑáéíóúüñ/])([A-Za-zÁÉÍÓÚÜÑáéíóúüñ/]+)(\s*)(</td>)', _I)
+
+ADV_COMMON = r'(bien|mal|siempre|nunca|ahora|luego|hoy|mañana|muy|casi|ya|pronto|tarde|aquí|alli|allá|así|también|tampoco)'
+ADV_SPAN_VA_A_RE = re.compile(r'<span\s+class="es">\s*va\s*a\s*</span>', _I)
+ADV_MENTE_RE = re.compile(r'\b([A-Za-zÁÉÍÓÚÜÑáéíóúüñ]+mente)\b', _I)
+ADV_COMMON_RE = re.compile(rf'\b{ADV_COMMON}\b', _I)
+ADV_LAST_WORD_RE = re.compile(r'(?<![A-Za-zÁÉÍÓÚÜÑáéíóúüñ])([A-Za-zÁÉÍÓÚÜÑáéíóúüñ]{3,})(\s*)(</td>)', _I)
+
+
+# -----------------------
+# Tag tokenizer (single forward pass per lookup; tolerant of unclosed and nested tags)
+# -----------------------
+
+@lru_cache(maxsize=64)
+def _title_re(section_title_regex: str):
+    return re.compile(rf'(?:{section_title_regex})', _I)
+
+
+@lru_cache(maxsize=16)
+def _tags_re(*names):
+    """Open/close tags of the given names only; group(1) is '/' for a closing tag, group(2) the name."""
+    return re.compile(rf'<(/?)({"|".join(names)})\b[^<>]*>', _I)
+
+
+def _span_text(m) -> str:
+    """Inner text of an ES_SPAN_RE match, trimmed like the old '\\s*(…+?)\\s*' capture."""
+    raw = m.group(1)
+    return raw.strip() or raw[-1:]
+
+
+@lru_cache(maxsize=8)
+def _headings(html: str):
+    """
+    (start, end, heading_text) for every closed <h2>…</h2>; an unclosed <h2> is dropped.
+    Cached: one document is looked up section by section, and str caches its own hash.
+    """
+    out, open_m = [], None
+    for m in _tags_re('h2').finditer(html):
+        if not m.group(1):
+            open_m = m
+        elif open_m is not None:
+            inner = html[open_m.end():m.start()]
+            out.append((open_m.start(), m.end(), WS_RE.sub(" ", TAG_RE.sub("", inner)).strip()))
+            open_m = None
+    return tuple(out)
+
+
+class _Section:
+    """Spans of one section: heading [start, body_start), body [body_start, body_end), tail [body_end, end)."""
+    __slots__ = ("start", "body_start", "body_end", "end")
+
+    def __init__(self, start, body_start, body_end, end):
+        self.start, self.body_start, self.body_end, self.end = start, body_start, body_end, end
+
+
+def _find_section(html: str, section_title_regex: str):
+    """Locate the first section whose <h2> text matches the title regex."""
+    title_re = _title_re(section_title_regex)
+    for h2_start, h2_end, text in _headings(html):
+        if title_re.fullmatch(text):
+            return _section_at(html, h2_start, h2_end)
+    return None
+
+
+def _section_at(html: str, h2_start: int, h2_end: int):
+    """
+    The section headed by the <h2> at [h2_start, h2_end).
+    The body runs to the </div> that closes the section's own <div> (nested divs are balanced).
+    Sections never nest, so the body also stops at the next <h2> (or the end of input) when
+    that </div> is missing; each lookup therefore scans at most one section.
+    """
+    depth = 0
+    for m in _tags_re('div', 'h2').finditer(html, h2_end):
+        closing, name = m.group(1), m.group(2).lower()
+        if name == 'div':
+            if not closing:
+                depth += 1
+            elif depth:
+                depth -= 1
+            else:
+                return _Section(h2_start, h2_end, m.start(), m.end())
+        elif name == 'h2' and not closing:
+            return _Section(h2_start, h2_end, m.start(), m.start())
+    return _Section(h2_start, h2_end, len(html), len(html))
+
+
+def _element_spans(fragment: str, tag: str, implicit_end=()):
+    """
+    Yield (start, inner_start, inner_end, end) for each <tag>…</tag> in fragment.
+    An element left open is closed by the next <tag> or by any closing tag in implicit_end
+    (as an HTML parser would); one still open at the end of the fragment is dropped.
+    """
+    cur = None
+    for m in _tags_re(tag, *implicit_end).finditer(fragment):
+        closing, name = m.group(1), m.group(2).lower()
+        if name == tag:
+            if not closing:
+                if cur is not None:
+                    yield cur.start(), cur.end(), m.start(), m.start()
+                cur = m
+            elif cur is not None:
+                yield cur.start(), cur.end(), m.start(), m.end()
+                cur = None
+        elif closing and name in implicit_end and cur is not None:
+            yield cur.start(), cur.end(), m.start(), m.start()
+            cur = None
+
+
+def _tbody_spans(fragment: str):
+    """Tbodies in fragment; a tbody truncated mid-table still yields the rows that arrived."""
+    spans = list(_element_spans(fragment, 'tbody', ('table',)))
+    if not spans:
+        m = next((t for t in _tags_re('tbody').finditer(fragment) if not t.group(1)), None)
+        if m:
+            spans.append((m.start(), m.end(), len(fragment), len(fragment)))
+    return spans
+
+
+def _row_spans(fragment: str):
+    return list(_element_spans(fragment, 'tr', ('tbody', 'table')))
+
+
+def _rows(fragment: str):
+    return [fragment[s:e] for s, _is, _ie, e in _row_spans(fragment)]
+
+
+def _sub_spans(text: str, spans, fn) -> str:
+    """Rebuild text with fn(start, inner_start, inner_end, end) replacing each span."""
+    out, pos = [], 0
+    for span in spans:
+        out.append(text[pos:span[0]])
+        out.append(fn(*span))
+        pos = span[3]
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def _sub_rows(fragment: str, fix_row) -> str:
+    return _sub_spans(fragment, _row_spans(fragment), lambda s, _is, _ie, e: fix_row(fragment[s:e]))
+
+
+class _Cell:
+    """Match-like view of one <td>…</td>: group(0) is the whole cell, group(1) its inner HTML."""
+    __slots__ = ("_row", "_span")
+
+    def __init__(self, row_html, span):
+        self._row, self._span = row_html, span
+
+    def group(self, i=0):
+        s, i_s, i_e, e = self._span
+        return self._row[s:e] if i == 0 else self._row[i_s:i_e]
+
+    def span(self):
+        return self._span[0], self._span[3]
+
+
+def _get_cells(row_html: str):
+    # Only explicitly closed cells: the fixers rely on the trailing </td>
+    return [_Cell(row_html, sp) for sp in _element_spans(row_html, 'td') if row_html[sp[2]:sp[3]]]
+
 
 def _replace_in_section(html: str, section_title_regex: str, replacer):
-    m = re.search(rf'(<h2>\s*{section_title_regex}\s*</h2>)(.*?)(</div>)',
-                  html, flags=re.IGNORECASE | re.DOTALL)
-    if not m:
+    sec = _find_section(html, section_title_regex)
+    if not sec:
         return html
-    head, body, tail = m.group(1), m.group(2), m.group(3)
-    new_body = replacer(body)
-    return html.replace(m.group(0), f"{head}{new_body}{tail}", 1)
+    return html[:sec.body_start] + replacer(html[sec.body_start:sec.body_end]) + html[sec.body_end:]
 
 
 def _tbody_edit(section_html: str, edit_fn):
-    return re.sub(
-        r'(<tbody[^>]*>)(.*?)(</tbody>)',
-        lambda m: f'{m.group(1)}{edit_fn(m.group(2))}{m.group(3)}',
-        section_html, flags=re.IGNORECASE | re.DOTALL
-    )
+    return _sub_spans(section_html, _tbody_spans(section_html),
+                      lambda s, i_s, i_e, e: section_html[s:i_s] + edit_fn(section_html[i_s:i_e]) + section_html[i_e:e])
 
 
-def _get_cells(row_html: str):
-    return list(re.finditer(r'<td[^>]*>(.*?)</td>', row_html, flags=re.IGNORECASE | re.DOTALL))
+def _move_span_off_aux(m) -> str:
+    """'<span class="es">… va a correr …</span>' → '… va a <span class="es">correr</span> …'."""
+    content = m.group(1)
+    aux = VERB_AUX_INF_RE.search(content)
+    if not aux:
+        return m.group(0)
+    return f'{content[:aux.start()]}{aux.group(1)} a <span class="es">{aux.group(2)}</span>{content[aux.end():]}'
 
 
 def ensure_nouns_en_blue_and_parentheses_plain(body_html: str) -> str:
@@ -466,7 +1003,7 @@ def ensure_nouns_en_blue_and_parentheses_plain(body_html: str) -> str:
     Nouns:
       • EN TD: color the noun word (not the article) blue if not already.
       • ES TD: ensure exactly one <span class="es">…</span> on the main noun (after article),
-               and remove any spans inside parentheses.
+               and unwrap any span pair inside parentheses.
     """
     def fix_one_tbody(tb):
         def fix_row(row_html: str) -> str:
@@ -475,32 +1012,25 @@ def ensure_nouns_en_blue_and_parentheses_plain(body_html: str) -> str:
                 # EN: wrap noun word (after "the ")
                 en_td = tds[0].group(0)
                 if 'class="en"' not in en_td:
-                    en_td = re.sub(r'\b(the)\s+([A-Za-zÁÉÍÓÚÜÑáéíóúüñ\-]+)',
-                                   r'\1 <span class="en">\2</span>', en_td, flags=re.IGNORECASE)
+                    en_td = NOUN_EN_RE.sub(r'\1 <span class="en">\2</span>', en_td)
 
-                # ES: strip spans inside parentheses
+                # ES: unwrap spans lying entirely inside parentheses; a pair crossing a parenthesis is left alone
                 es_td = tds[1].group(0)
-                es_td = re.sub(r'$[^()]*$', lambda m: re.sub(r'</?span[^>]*>', '', m.group(0), flags=re.IGNORECASE),
-                               es_td, flags=re.IGNORECASE)
+                es_td = NOUN_PAREN_RE.sub(lambda m: SPAN_PAIR_RE.sub(r'\1', m.group(0)), es_td)
 
                 # ES: ensure exactly ONE span on main noun after article
-                art_noun_pat = r'\b(el|la|los|las)\s+([a-záéíóúüñ/]+)'
-                def collapse_multi_spans(s):
-                    return re.sub(r'<span\s+class="es">\s*([^<]+?)\s*</span>', r'\1', s, flags=re.IGNORECASE)
-                es_clean = collapse_multi_spans(es_td)
-
-                if re.search(art_noun_pat, es_clean, flags=re.IGNORECASE):
-                    es_wrapped = re.sub(
-                        art_noun_pat,
+                es_clean = ES_SPAN_RE.sub(_span_text, es_td)
+
+                if NOUN_ART_RE.search(es_clean):
+                    es_wrapped = NOUN_ART_RE.sub(
                         lambda m: f'{m.group(1)} <span class="es">{m.group(2)}</span>',
-                        es_clean, count=1, flags=re.IGNORECASE
+                        es_clean, count=1
                     )
                 else:
                     es_wrapped = es_clean
                     if '<span class="es">' not in es_wrapped:
-                        es_wrapped = re.sub(r'>(\s*)([A-Za-zÁÉÍÓÚÜÑáéíóúüñ/]+)',
-                                            r'>\1<span class="es">\2</span>',
-                                            es_wrapped, count=1, flags=re.IGNORECASE)
+                        es_wrapped = NOUN_FIRST_WORD_RE.sub(r'>\1<span class="es">\2</span>',
+                                                            es_wrapped, count=1)
 
                 # rebuild row
                 start0, end0 = tds[0].span()
@@ -508,8 +1038,7 @@ def ensure_nouns_en_blue_and_parentheses_plain(body_html: str) -> str:
                 row_html = row_html[:start0] + en_td + row_html[end0:start1] + es_wrapped + row_html[end1:]
             return row_html
 
-        return re.sub(r'<tr[^>]*>.*?</tr>', lambda m: fix_row(m.group(0)),
-                      tb, flags=re.IGNORECASE | re.DOTALL)
+        return _sub_rows(tb, fix_row)
 
     def repl(section_html):
         return _tbody_edit(section_html, fix_one_tbody)
@@ -524,24 +1053,15 @@ def fix_verbs_highlight(body_html: str) -> str:
       • EN: 'is/are going to' stays black
       • Ensure there is exactly one <span class="es">…</span> per ES cell (wrap the infinitive if missing)
     """
-    aux_pat = r'(voy|vas|va|vamos|vais|van)\s+a\s+([a-záéíóúüñ]+(?:se)?)'
-
     def fix_one_tbody(tb):
         s = tb
         # Move highlight away from auxiliaries into the infinitive
-        s = re.sub(
-            r'<span\s+class="es">([^<]*?)\b(voy|vas|va|vamos|vais|van)\s+a\s+([a-záéíóúüñ/]+)\b([^<]*?)</span>',
-            r'\1\2 a <span class="es">\3</span>\4', s, flags=re.IGNORECASE
-        )
-        s = re.sub(
-            r'<span\s+class="es">\s*(voy|vas|va|vamos|vais|van)\s+a\s+([a-záéíóúüñ/]+)\s*</span>',
-            r'\1 a <span class="es">\2</span>', s, flags=re.IGNORECASE
-        )
-        s = re.sub(r'<span\s+class="es">\s*(va\s*a)\s*</span>', r'\1', s, flags=re.IGNORECASE)
+        s = ES_SPAN_RE.sub(_move_span_off_aux, s)
+        s = VERB_SPAN_AUX_RE.sub(r'\1 a <span class="es">\2</span>', s)
+        s = VERB_SPAN_VA_A_RE.sub(r'\1', s)
 
         # EN: unwrap any colored "is/are going to"
-        s = re.sub(r'<span\s+class="en">\s*(is|are)\s+going\s+to\s*</span>',
-                   r'\1 going to', s, flags=re.IGNORECASE)
+        s = EN_GOING_TO_RE.sub(r'\1 going to', s)
 
         # Ensure exactly one ES span in ES cell by wrapping the infinitive if missing
         def fix_row(row_html: str) -> str:
@@ -549,18 +1069,16 @@ def fix_verbs_highlight(body_html: str) -> str:
             if len(tds) >= 2:
                 es_td = tds[1].group(0)
                 # Remove accidental multiple ES spans, keep bare text
-                es_td_clean = re.sub(r'<span\s+class="es">\s*([^<]+?)\s*</span>', r'\1', es_td, flags=re.IGNORECASE)
+                es_td_clean = ES_SPAN_RE.sub(_span_text, es_td)
                 # Try to wrap infinitive after 'a '
-                if re.search(aux_pat, es_td_clean, flags=re.IGNORECASE):
-                    es_td_wrapped = re.sub(aux_pat,
-                                           lambda m: f'{m.group(1)} a <span class="es">{m.group(2)}</span>',
-                                           es_td_clean, count=1, flags=re.IGNORECASE)
+                if VERB_AUX_RE.search(es_td_clean):
+                    es_td_wrapped = VERB_AUX_RE.sub(lambda m: f'{m.group(1)} a <span class="es">{m.group(2)}</span>',
+                                                    es_td_clean, count=1)
                 else:
                     # Fallback: wrap last word (likely the infinitive)
                     if '<span class="es">' not in es_td_clean:
-                        es_td_wrapped = re.sub(r'([A-Za-zÁÉÍÓÚÜÑáéíóúüñ/]+)(\s*)(</td>)',
-                                               r'<span class="es">\1</span>\2\3',
-                                               es_td_clean, count=1, flags=re.IGNORECASE)
+                        es_td_wrapped = VERB_LAST_WORD_RE.sub(r'<span class="es">\1</span>\2\3',
+                                                              es_td_clean, count=1)
                     else:
                         es_td_wrapped = es_td_clean
 
@@ -569,8 +1087,7 @@ def fix_verbs_highlight(body_html: str) -> str:
                 row_html = row_html[:start1] + es_td_wrapped + row_html[end1:]
             return row_html
 
-        return re.sub(r'<tr[^>]*>.*?</tr>', lambda m: fix_row(m.group(0)),
-                      s, flags=re.IGNORECASE | re.DOTALL)
+        return _sub_rows(s, fix_row)
 
     def repl(section_html):
         return _tbody_edit(section_html, fix_one_tbody)
@@ -584,33 +1101,27 @@ def fix_adverbs_highlight(body_html: str) -> str:
       • Color ONLY the adverb; NEVER color 'is/are going to' (EN) or 'va a' (ES).
       • Ensure there is exactly one <span class="es">…</span> per ES cell (wrap a -mente adverb or a common adverb).
     """
-    common_adv = r'(bien|mal|siempre|nunca|ahora|luego|hoy|mañana|muy|casi|ya|pronto|tarde|aquí|alli|allá|así|también|tampoco)'
     def fix_one_tbody(tb):
         s = tb
-        s = re.sub(r'<span\s+class="en">\s*(is|are)\s+going\s+to\s*</span>', r'\1 going to', s, flags=re.IGNORECASE)
-        s = re.sub(r'<span\s+class="es">\s*va\s*a\s*</span>', r'va a', s, flags=re.IGNORECASE)
+        s = EN_GOING_TO_RE.sub(r'\1 going to', s)
+        s = ADV_SPAN_VA_A_RE.sub(r'va a', s)
 
         def fix_row(row_html: str) -> str:
             tds = _get_cells(row_html)
             if len(tds) >= 2:
                 es_td = tds[1].group(0)
                 # Remove accidental multiple ES spans, keep bare text
-                es_td_clean = re.sub(r'<span\s+class="es">\s*([^<]+?)\s*</span>', r'\1', es_td, flags=re.IGNORECASE)
+                es_td_clean = ES_SPAN_RE.sub(_span_text, es_td)
                 if '<span class="es">' not in es_td_clean:
                     # Prefer -mente adverb
-                    if re.search(r'\b([A-Za-zÁÉÍÓÚÜÑáéíóúüñ]+mente)\b', es_td_clean, flags=re.IGNORECASE):
-                        es_td_wrapped = re.sub(r'\b([A-Za-zÁÉÍÓÚÜÑáéíóúüñ]+mente)\b',
-                                               r'<span class="es">\1</span>',
-                                               es_td_clean, count=1, flags=re.IGNORECASE)
-                    elif re.search(rf'\b{common_adv}\b', es_td_clean, flags=re.IGNORECASE):
-                        es_td_wrapped = re.sub(rf'\b{common_adv}\b',
-                                               r'<span class="es">\1</span>',
-                                               es_td_clean, count=1, flags=re.IGNORECASE)
+                    if ADV_MENTE_RE.search(es_td_clean):
+                        es_td_wrapped = ADV_MENTE_RE.sub(r'<span class="es">\1</span>', es_td_clean, count=1)
+                    elif ADV_COMMON_RE.search(es_td_clean):
+                        es_td_wrapped = ADV_COMMON_RE.sub(r'<span class="es">\1</span>', es_td_clean, count=1)
                     else:
                         # Fallback: wrap last non-trivial token (avoid 'va', 'a')
-                        es_td_wrapped = re.sub(r'([A-Za-zÁÉÍÓÚÜÑáéíóúüñ]{3,})(\s*)(</td>)',
-                                               r'<span class="es">\1</span>\2\3',
-                                               es_td_clean, count=1, flags=re.IGNORECASE)
+                        es_td_wrapped = ADV_LAST_WORD_RE.sub(r'<span class="es">\1</span>\2\3',
+                                                             es_td_clean, count=1)
                 else:
                     es_td_wrapped = es_td_clean
                 # rebuild row
@@ -618,8 +1129,7 @@ def fix_adverbs_highlight(body_html: str) -> str:
                 row_html = row_html[:start1] + es_td_wrapped + row_html[end1:]
             return row_html
 
-        return re.sub(r'<tr[^>]*>.*?</tr>', lambda m: fix_row(m.group(0)),
-                      s, flags=re.IGNORECASE | re.DOTALL)
+        return _sub_rows(s, fix_row)
 
     def repl(section_html):
         return _tbody_edit(section_html, fix_one_tbody)
@@ -627,29 +1137,129 @@ def fix_adverbs_highlight(body_html: str) -> str:
     return _replace_in_section(body_html, r'Adverbs', repl)
 
 
+def normalize_highlights(html: str) -> str:
+    """Color normalization (does not change structure or quotas intent)."""
+    html = fix_verbs_highlight(html)
+    html = fix_adverbs_highlight(html)
+    return ensure_nouns_en_blue_and_parentheses_plain(html)
+
+
+def strip_code_fences(text: str) -> str:
+    """'```html\n<doc>\n```' → '<doc>'. Plain slicing: a regex over the body backtracks on unterminated fences."""
+    text = (text or "").strip()
+    if len(text) < 6 or not (text.startswith("```") and text.endswith("```")):
+        return text
+    inner = text[3:-3]
+    return inner[FENCE_LANG_RE.match(inner).end():].strip()
+
+
+# -----------------------
+# Truncated output: continue from the last complete row instead of regenerating
+# -----------------------
+
+MAX_CONTINUATIONS = int(os.getenv("MODEL_MAX_CONTINUATIONS", "3"))
+OPEN_FENCE_RE = re.compile(r"^\s*```(?:html|xml|markdown)?[ \t]*\n?", re.IGNORECASE)
+CLOSE_FENCE_RE = re.compile(r"\n?```\s*$")
+
+CONTINUATION_PROMPT = (
+    "Your previous reply was cut off by the length limit. Continue the SAME HTML document exactly "
+    "where it stops — right after the last complete </tr> above. Do NOT repeat anything already written, "
+    "do NOT restart the document, no commentary or code fences. Finish the remaining rows and sections "
+    "and close every open tag through </html>."
+)
+
+
+def _unfence_piece(text: str) -> str:
+    """Drop a fence opening and/or closing one piece of a multi-part reply (pieces may be cut mid-fence)."""
+    return CLOSE_FENCE_RE.sub("", OPEN_FENCE_RE.sub("", text or "", count=1), count=1)
+
+
+def _last_row_end(html: str) -> int:
+    """Offset just past the last </tr>, or -1 when no row has been completed."""
+    last = -1
+    for m in _tags_re('tr').finditer(html):
+        if m.group(1):
+            last = m.end()
+    return last
+
+
+def _completion_tokens(completion) -> int:
+    return getattr(getattr(completion, "usage", None), "completion_tokens", 0) or 0
+
+
+def _prompt_tokens(completion) -> int:
+    return getattr(getattr(completion, "usage", None), "prompt_tokens", 0) or 0
+
+
+def _drop_repeated_row(prefix: str, piece: str) -> str:
+    """Models sometimes restate the last row they saw; keep it only once."""
+    cut = _last_row_end(prefix)
+    start = prefix.rfind("<tr", 0, cut) if cut > 0 else -1
+    if start >= 0:
+        last_row = prefix[start:cut]
+        stripped = piece.lstrip()
+        if stripped.startswith(last_row):
+            return stripped[len(last_row):]
+    return piece
+
+
+def complete_with_continuation(client, route: str, messages, temperature: float, max_tokens: int):
+    """
+    routed_completion that survives finish_reason == "length".
+    A cut-off reply is trimmed back to its last complete </tr> and the model is asked to continue
+    from there (the partial text goes back as the assistant turn), up to MAX_CONTINUATIONS times.
+    Returns (stitched_text, {"continuations", "truncated", "prompt_tokens", "completion_tokens"}), with
+    token counts summed over every call.
+    """
+    completion = routed_completion(client, route, messages=messages, temperature=temperature, max_tokens=max_tokens)
+    choice = completion.choices[0]
+    used = _completion_tokens(completion)
+    sent = _prompt_tokens(completion)
+    text = _unfence_piece(choice.message.content)
+    continuations = 0
+    while getattr(choice, "finish_reason", None) == "length" and continuations < MAX_CONTINUATIONS:
+        cut = _last_row_end(text)
+        if cut > 0:
+            text = text[:cut]
+        continuations += 1
+        completion = routed_completion(
+            client,
+            route,
+            messages=list(messages) + [
+                {"role": "assistant", "content": text},
+                {"role": "user", "content": CONTINUATION_PROMPT},
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        choice = completion.choices[0]
+        used += _completion_tokens(completion)
+        sent += _prompt_tokens(completion)
+        text += _drop_repeated_row(text, _unfence_piece(choice.message.content))
+    return text, {"continuations": continuations, "truncated": getattr(choice, "finish_reason", None) == "length",
+                  "prompt_tokens": sent, "completion_tokens": used}
+
+
 # -----------------------
 # Counting & verification (respect selected sections)
 # -----------------------
 
 def _extract_section_body(html: str, section_title_regex: str) -> str:
-    m = re.search(rf'(<h2>\s*{section_title_regex}\s*</h2>)(.*?)(</div>)',
-                  html, flags=re.IGNORECASE | re.DOTALL)
-    if not m:
-        return ""
-    return m.group(2)
+    sec = _find_section(html, section_title_regex)
+    return html[sec.body_start:sec.body_end] if sec else ""
 
 
 def _tbody_inner(section_html: str) -> str:
-    m = re.search(r'<tbody[^>]*>(.*?)</tbody>', section_html, flags=re.IGNORECASE | re.DOTALL)
-    return m.group(1) if m else ""
+    spans = _tbody_spans(section_html)
+    return section_html[spans[0][1]:spans[0][2]] if spans else ""
 
 
 def _count_es_spans(html_fragment: str) -> int:
-    return len(re.findall(r'<span\s+class="es">', html_fragment, flags=re.IGNORECASE))
+    return len(ES_SPAN_OPEN_RE.findall(html_fragment))
 
 
 def _count_rows(html_fragment: str) -> int:
-    return len(re.findall(r'<tr[^>]*>.*?</tr>', html_fragment, flags=re.IGNORECASE | re.DOTALL))
+    return len(_row_spans(html_fragment))
 
 
 def verify_vocab_counts_selected(full_html: str, selected_nvda: set, check_phr: bool, check_q: bool):
@@ -728,6 +1338,49 @@ def needs_repair_selected(counts, quotas, rows_minmax, selected_nvda: set, selec
     return False
 
 
+def build_validation_report(full_html: str, quotas_map: dict, rows_minmax, selected: set,
+                            initial_counts=None, repair_performed: bool = False, filler_rows=None):
+    """
+    Machine-readable verification result returned to the client with the document.
+    NVAD sections report ES-span counts against exact quotas; Common sections report rows against [min, max].
+    """
+    selected_nvda = {s for s in selected if s in {'nouns', 'verbs', 'adjectives', 'adverbs'}}
+    counts = verify_vocab_counts_selected(full_html, selected_nvda, 'phrases' in selected, 'questions' in selected)
+    pmin, pmax = rows_minmax
+
+    sections = {}
+    for sel_key, key, _rx, _title in _RESIZABLE_SECTIONS:
+        if sel_key not in selected:
+            continue
+        have = counts.get(key, 0)
+        if key in ('phr_rows', 'q_rows'):
+            sections[sel_key] = {"count": have, "min": pmin, "max": pmax, "ok": pmin <= have <= pmax}
+        else:
+            sections[sel_key] = {"count": have, "target": quotas_map[key], "ok": have == quotas_map[key]}
+
+    return {
+        "ok": all(s["ok"] for s in sections.values()),
+        "sections": sections,
+        "initial_counts": initial_counts,
+        "repair_performed": repair_performed,
+        "filler_rows": filler_rows or {},
+        "distinct_words": distinct_es_words(full_html, selected),
+    }
+
+
+def distinct_es_words(full_html: str, selected: set):
+    """Distinct Spanish target words (ES span text, lowercased) per selected NVAD section and overall."""
+    by_section, all_words = {}, set()
+    for sel_key, key, rx, _title in _RESIZABLE_SECTIONS:
+        if sel_key not in selected or key in ('phr_rows', 'q_rows'):
+            continue
+        tb = _tbody_inner(_extract_section_body(full_html, rx))
+        words = {WS_RE.sub(" ", _span_text(m)).strip().lower() for m in ES_SPAN_RE.finditer(tb)}
+        by_section[sel_key] = len(words)
+        all_words |= words
+    return {"total": len(all_words), "by_section": by_section}
+
+
 def build_repair_prompt_selected(lo, hi, quotas, rows_min, selected_nvda: set, selected_phr: bool, selected_q: bool):
     n, v, a, d = quotas
     total = 0
@@ -789,8 +1442,8 @@ def _collect_span_es_words(full_html: str, limit: int = 40):
     for title in [r"Nouns", r"Verbs\s+in\s+Sentences", r"Adjectives", r"Adverbs"]:
         body = _extract_section_body(full_html, title)
         tb = _tbody_inner(body)
-        for m in re.finditer(r'<span\s+class="es">\s*([^<]+?)\s*</span>', tb, flags=re.IGNORECASE):
-            w = re.sub(r"\s+", " ", m.group(1)).strip()
+        for m in ES_SPAN_RE.finditer(tb):
+            w = WS_RE.sub(" ", _span_text(m)).strip()
             key = w.lower()
             if w and key not in seen:
                 seen.add(key); words.append(w)
@@ -799,19 +1452,20 @@ def _collect_span_es_words(full_html: str, limit: int = 40):
     return words
 
 
-def _inject_rows_into_section(full_html: str, section_title_regex: str, new_rows_html: str) -> str:
-    pattern = rf'(<h2>\s*{section_title_regex}\s*</h2>)(.*?)(</div>)'
-    m = re.search(pattern, full_html, flags=re.IGNORECASE | re.DOTALL)
-    if not m:
+def _replace_section_tbody(full_html: str, section_title_regex: str, edit_fn) -> str:
+    """Rewrite the first <tbody> inner HTML of a section with edit_fn(old_inner)."""
+    sec = _find_section(full_html, section_title_regex)
+    if not sec:
         return full_html
-    section_html = m.group(2)
-    tb_m = re.search(r'(<tbody[^>]*>)(.*?)(</tbody>)', section_html, flags=re.IGNORECASE | re.DOTALL)
-    if not tb_m:
+    spans = _tbody_spans(full_html[sec.body_start:sec.body_end])
+    if not spans:
         return full_html
-    before, body, after = tb_m.group(1), tb_m.group(2), tb_m.group(3)
-    body = body + new_rows_html
-    section_html_fixed = section_html.replace(tb_m.group(0), f"{before}{body}{after}", 1)
-    return full_html.replace(m.group(0), f"{m.group(1)}{section_html_fixed}{m.group(3)}", 1)
+    i_s, i_e = sec.body_start + spans[0][1], sec.body_start + spans[0][2]
+    return full_html[:i_s] + edit_fn(full_html[i_s:i_e]) + full_html[i_e:]
+
+
+def _inject_rows_into_section(full_html: str, section_title_regex: str, new_rows_html: str) -> str:
+    return _replace_section_tbody(full_html, section_title_regex, lambda body: body + new_rows_html)
 
 
 def _ensure_common_minimum_selected(full_html: str, min_rows: int, max_rows: int, selected_phr: bool, selected_q: bool) -> str:
@@ -859,6 +1513,1134 @@ def _ensure_common_minimum_selected(full_html: str, min_rows: int, max_rows: int
     return full_html
 
 
+# -----------------------
+# Conversations & Monologue validators (structure rules from the guidance block)
+# -----------------------
+
+CONV_TURNS = 8
+CONV_SENTENCES_PER_TURN = (2, 3)
+CONV_WORDS_PER_SENTENCE = (1, 15)
+MONOLOGUE_SENTENCES = (10, 15)
+# A document has a handful of these; more is malformed output and is not worth validating
+MAX_DISCOURSE_SECTIONS = 12
+# Section retries per request (serial calls after the generation; keeps requests inside the function timeout)
+MAX_DISCOURSE_RETRIES = int(os.getenv("MAX_DISCOURSE_RETRIES", "2"))
+
+CONV_TITLE_RE = re.compile(r'Conversation\s+\d+', re.IGNORECASE)
+CONV_HEADER_TEXT_RE = re.compile(r'(?:Conversation|Conversaci[oó]n)\s+\d+', re.IGNORECASE)
+MONOLOGUE_TITLE_RE = re.compile(r'Monologue', re.IGNORECASE)
+# A period after these never ends a sentence ("Mr. Smith", "la Sra. Ruiz")
+_TITLE_ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "sr", "sra", "srta", "srs", "ud", "uds", "dra"}
+# ...after these only when the next word is capitalized ("at 3.30 p.m. tomorrow" vs "at 3 p.m. We")
+DOTTED_ABBREVIATION_RE = re.compile(r'(?:[a-z]\.)+[a-z]|etc|approx|aprox', re.IGNORECASE)
+_TOKEN_OPENERS = "(\"'“«¿¡"
+_TOKEN_CLOSERS = ")\"'”»"
+HEADER_CELL_RE = re.compile(r'<th\b|<td\b[^<>]*\bcolspan\s*=', _I)
+
+
+def _cell_text(cell_html: str) -> str:
+    return WS_RE.sub(" ", html_lib.unescape(TAG_RE.sub(" ", cell_html))).strip()
+
+
+def _ends_sentence(token: str, next_token: str) -> bool:
+    token = token.rstrip(_TOKEN_CLOSERS)
+    if not token.endswith((".", "!", "?", "…")):
+        return False
+    if token.endswith(("…", "..")):
+        # An ellipsis ends the sentence only before a capital ("Wait... what" is one)
+        return not next_token or next_token.lstrip(_TOKEN_OPENERS)[:1].isupper()
+    if not token.endswith("."):
+        return True
+    word = token.rstrip(".").lstrip(_TOKEN_OPENERS)
+    if word.lower() in _TITLE_ABBREVIATIONS:
+        return False
+    if DOTTED_ABBREVIATION_RE.fullmatch(word):
+        return not next_token or next_token.lstrip(_TOKEN_OPENERS)[:1].isupper()
+    return True
+
+
+def split_sentences(text: str):
+    """
+    Sentences of a turn or paragraph, split after . ! ? … at word ends. Decimals ("3.30") and
+    abbreviations ("Mr.", "Sra.", "p.m.", "etc.") do not split; a missing final terminator still counts.
+    """
+    tokens = (text or "").split()
+    out, current = [], []
+    for i, token in enumerate(tokens):
+        current.append(token)
+        if _ends_sentence(token, tokens[i + 1] if i + 1 < len(tokens) else ""):
+            out.append(" ".join(current))
+            current = []
+    if current:
+        out.append(" ".join(current))
+    return [s for s in out if s.strip(" ¿¡\"'“”.!?…")]
+
+
+def _data_rows(section_html: str):
+    """(en_text, es_text) for every tbody row with two non-empty cells; <th> and colspan header rows are skipped."""
+    out = []
+    for row in _rows(_tbody_inner(section_html)):
+        if HEADER_CELL_RE.search(row):
+            continue
+        tds = _get_cells(row)
+        if len(tds) >= 2:
+            en, es = _cell_text(tds[0].group(1)), _cell_text(tds[1].group(1))
+            if en and es:
+                out.append((en, es))
+    return out
+
+
+def validate_conversation(section_html: str):
+    """Return a list of rule violations for one conversation section (empty = valid)."""
+    issues = []
+    # The guidance asks for a header row inside the table ("Conversation 1 — …" | "Conversación 1 — …")
+    turns = [t for t in _data_rows(section_html) if not CONV_HEADER_TEXT_RE.match(t[0])]
+    if len(turns) != CONV_TURNS:
+        issues.append(f"has {len(turns)} turns; needs exactly {CONV_TURNS} (4 per speaker)")
+    s_lo, s_hi = CONV_SENTENCES_PER_TURN
+    w_lo, w_hi = CONV_WORDS_PER_SENTENCE
+    with_question = with_three = 0
+    for i, (en, es) in enumerate(turns, 1):
+        sentences = split_sentences(en)
+        if not s_lo <= len(sentences) <= s_hi:
+            issues.append(f"turn {i} has {len(sentences)} sentences; needs {s_lo}–{s_hi}")
+        for s in sentences:
+            n = len(s.split())
+            if not w_lo <= n <= w_hi:
+                issues.append(f"turn {i} has a {n}-word sentence; each must be {w_lo}–{w_hi} words")
+                break
+        with_question += "?" in en
+        with_three += len(sentences) == 3
+    if turns and with_question * 2 < len(turns):
+        issues.append(f"only {with_question} of {len(turns)} turns ask a question; at least half must")
+    if turns and with_three * 2 < len(turns):
+        issues.append(f"only {with_three} of {len(turns)} turns have 3 sentences; at least half must")
+    return issues
+
+
+def validate_monologue(section_html: str):
+    issues = []
+    rows = _data_rows(section_html)
+    if not rows:
+        return ["has no monologue row"]
+    lo, hi = MONOLOGUE_SENTENCES
+    en = " ".join(r[0] for r in rows)
+    es = " ".join(r[1] for r in rows)
+    if len(rows) > 1:
+        issues.append("must be one paragraph in a single row")
+    for label, text in (("English", en), ("Spanish", es)):
+        n = len(split_sentences(text))
+        if not lo <= n <= hi:
+            issues.append(f"{label} has {n} sentences; needs {lo}–{hi}")
+    return issues
+
+
+def validate_discourse_sections(full_html: str):
+    """
+    Validate every Conversation N / Monologue section present in the document.
+    Returns {section_title: [issues]} (only sections that exist; empty list = valid).
+    """
+    results = {}
+    for start, end, title in _headings(full_html or ""):
+        if title in results:
+            continue
+        for rx, check in ((CONV_TITLE_RE, validate_conversation), (MONOLOGUE_TITLE_RE, validate_monologue)):
+            if rx.match(title):
+                sec = _section_at(full_html, start, end)
+                results[title] = check(full_html[sec.body_start:sec.body_end])
+        if len(results) >= MAX_DISCOURSE_SECTIONS:
+            break
+    return results
+
+
+def build_section_retry_prompt(topic: str, title: str, issues) -> str:
+    """User message regenerating ONE conversation/monologue section only."""
+    if MONOLOGUE_TITLE_RE.match(title):
+        rules = (f"A lecture-style monologue of {MONOLOGUE_SENTENCES[0]}–{MONOLOGUE_SENTENCES[1]} sentences, "
+                 "one paragraph in ONE row: English cell left, complete Spanish translation right.")
+    else:
+        rules = (f"Exactly {CONV_TURNS} turns (4 per person), one <tr> per turn (English | Spanish). "
+                 f"Each turn {CONV_SENTENCES_PER_TURN[0]}–{CONV_SENTENCES_PER_TURN[1]} sentences/questions; "
+                 f"each sentence {CONV_WORDS_PER_SENTENCE[0]}–{CONV_WORDS_PER_SENTENCE[1]} words; "
+                 "at least half of the turns include a question and at least half have 3 sentences.")
+    return "\n".join([
+        "<!-- FCS SECTION RETRY",
+        f"Topic: “{topic}”. Rewrite ONLY the section “{title}”.",
+        "It failed these checks: " + "; ".join(issues) + ".",
+        rules,
+        "Return ONLY the skeleton below with <tr> rows inside <tbody>. No other sections, no commentary.",
+        "-->",
+        f'<div class="section"><h2>{title}</h2>',
+        '  <table class="tbl"><thead><tr><th>English</th><th lang="es">Español</th></tr></thead><tbody></tbody></table>',
+        "</div>",
+    ])
+
+
+def section_retry_max_tokens(title: str) -> int:
+    """Tokens for the longest valid conversation/monologue (~1.5 per word, ~40 of markup per row), plus headroom."""
+    if MONOLOGUE_TITLE_RE.match(title):
+        words, rows = 2 * MONOLOGUE_SENTENCES[1] * CONV_WORDS_PER_SENTENCE[1], 1
+    else:
+        words, rows = 2 * CONV_TURNS * CONV_SENTENCES_PER_TURN[1] * CONV_WORDS_PER_SENTENCE[1], CONV_TURNS
+    return int((1.5 * words + 40 * rows + 150) * SIZE_HEADROOM)
+
+
+def retry_failing_discourse_sections(client, base_system: str, prompt: str, full_html: str, max_tokens: int):
+    """
+    Section-only retries for failing conversations/monologue, at most MAX_DISCOURSE_RETRIES calls,
+    each sized for one section. Only sections of the prompt's skeleton are retried: the contract
+    forbids adding others, so a model-added section is reported but never regenerated.
+    A retry result replaces the section only when it passes every check: issue counts are not
+    comparable (one missing turn outweighs several long sentences).
+    Returns (html, {title: {"ok", "issues", "retried"}}).
+    """
+    requested = {title for _s, _e, title in _headings(_prompt_skeleton(prompt))}
+    report, retries = {}, 0
+    for title, issues in validate_discourse_sections(full_html).items():
+        retried = False
+        if issues and title in requested and retries < MAX_DISCOURSE_RETRIES:
+            retried, retries = True, retries + 1
+            completion = routed_completion(
+                client,
+                "repair",
+                messages=[
+                    {"role": "system", "content": base_system},
+                    {"role": "user", "content": build_section_retry_prompt(parse_topic(prompt), title, issues)},
+                ],
+                temperature=0.7,
+                max_tokens=min(max_tokens, section_retry_max_tokens(title)),
+            )
+            fresh = strip_code_fences(completion.choices[0].message.content)
+            rows = _section_rows(fresh, re.escape(title))
+            if rows:
+                candidate = _replace_section_tbody(full_html, re.escape(title), lambda _body: "".join(rows))
+                new_issues = validate_discourse_sections(candidate).get(title, issues)
+                if not new_issues:
+                    full_html, issues = candidate, new_issues
+        report[title] = {"ok": not issues, "issues": issues, "retried": retried}
+    return full_html, report
+
+
+# -----------------------
+# Incremental expansion (grow/shrink an existing document to a new range)
+# -----------------------
+
+def _section_rows(full_html: str, section_title_regex: str):
+    tb = _tbody_inner(_extract_section_body(full_html, section_title_regex))
+    return _rows(tb)
+
+
+def _trim_section(full_html: str, section_title_regex: str, keep: int, by_rows: bool) -> str:
+    """
+    Keep the leading rows of a section until 'keep' items remain (ES spans, or rows when by_rows).
+    Subcategory header rows (no ES span) are kept only if a kept data row follows them.
+    """
+    kept, pending, total = [], [], 0
+    for row in _section_rows(full_html, section_title_regex):
+        c = 1 if by_rows else _count_es_spans(row)
+        if c == 0 and not by_rows:
+            pending.append(row)
+            continue
+        if total >= keep:
+            break
+        kept.extend(pending); pending = []
+        kept.append(row)
+        total += c
+    return _replace_section_tbody(full_html, section_title_regex, lambda _body: "".join(kept))
+
+
+def expansion_plan(existing_html: str, targets):
+    """
+    Compare an existing document with the quotas for a new range.
+    Returns {count_key: delta}; positive = rows/words to add, negative = to trim.
+    """
+    selected = targets.selected
+    counts = verify_vocab_counts_selected(existing_html, targets.selected_nvda, 'phrases' in selected, 'questions' in selected)
+    lo_rows, hi_rows = targets.rows_minmax
+
+    plan = {}
+    for sel_key, key, _rx, _title in _RESIZABLE_SECTIONS:
+        if sel_key not in selected:
+            continue
+        have = counts.get(key, 0)
+        if key in ('phr_rows', 'q_rows'):
+            # Common sections only need to land inside [min, max] rows
+            plan[key] = lo_rows - have if have < lo_rows else (hi_rows - have if have > hi_rows else 0)
+        else:
+            plan[key] = targets.quotas[key] - have
+    return plan
+
+
+def build_expansion_prompt(topic: str, plan: dict, used_words) -> str:
+    """User message asking ONLY for the missing rows of the sections that grow."""
+    lines = [
+        "<!-- FCS VOCABULARY EXPANSION",
+        f"Topic: “{topic}”.",
+        "An existing vocabulary document is being extended. Write ONLY the NEW rows requested below.",
+        "EXACT NEW ITEMS PER SECTION (NVAD counted by <span class=\"es\">…</span>, Common sections by rows):",
+    ]
+    sections_html = []
+    for _sel, key, _rx, title in _RESIZABLE_SECTIONS:
+        add = plan.get(key, 0)
+        if add <= 0:
+            continue
+        unit = "rows" if key in ('phr_rows', 'q_rows') else "new vocabulary items"
+        lines.append(f"  • {title}: {add} {unit}")
+        sections_html.append(
+            f'  <div class="section"><h2>{title}</h2>\n'
+            f'    <table class="tbl"><tbody></tbody></table>\n'
+            f'  </div>'
+        )
+    if used_words:
+        lines.append("ALREADY USED — do NOT repeat any of these Spanish words as new targets:")
+        lines.append("  " + ", ".join(used_words))
+    lines.append("Follow the same coloring rules as the original document. Insert ONLY <tr> rows into each <tbody>.")
+    lines.append("Nouns: no subcategory header rows. Return the skeleton below filled in, nothing else.")
+    lines.append("-->")
+    return "\n".join(lines) + "\n<div class=\"fcs-doc\">\n" + "\n".join(sections_html) + "\n</div>"
+
+
+def apply_expansion(existing_html: str, new_rows_html: str, plan: dict) -> str:
+    """
+    Trim shrinking sections locally and splice generated rows into growing ones.
+    NVAD deltas are counted in ES spans, not rows: a row is taken only if all of its spans fit in
+    what is left of the delta and none repeats a Spanish word already in the document.
+    """
+    html = existing_html
+    used = {w.lower() for w in _collect_span_es_words(existing_html, limit=10 ** 6)}
+    for _sel, key, rx, _title in _RESIZABLE_SECTIONS:
+        delta = plan.get(key, 0)
+        by_rows = key in ('phr_rows', 'q_rows')
+        if delta < 0:
+            have = len(_section_rows(html, rx)) if by_rows else _count_es_spans(_tbody_inner(_extract_section_body(html, rx)))
+            html = _trim_section(html, rx, have + delta, by_rows)
+        elif delta > 0 and new_rows_html:
+            rows, added = [], 0
+            for r in _section_rows(new_rows_html, rx):
+                # Drop subcategory headers the model may add anyway; never overshoot the delta
+                c = 1 if by_rows else _count_es_spans(r)
+                if c == 0 or added + c > delta:
+                    continue
+                if not by_rows:
+                    words = {WS_RE.sub(" ", _span_text(m)).strip().lower() for m in ES_SPAN_RE.finditer(r)}
+                    if words & used:
+                        continue
+                    used |= words
+                rows.append(r)
+                added += c
+            if rows:
+                html = _inject_rows_into_section(html, rx, "".join(rows))
+    return html
+
+
+def run_expansion(client, base_system: str, prompt: str, existing_html: str, max_tokens: int, route=None):
+    """
+    Resize an existing generated document to the range in 'prompt'.
+    Only the missing rows are requested from the model; shrinking is purely local.
+    route overrides the size-based "small"/"full" choice (count top-ups use "repair").
+    Returns (html, info) where info records the per-section plan and whether the model was called.
+    """
+    targets = vocab_targets(prompt)
+    if not targets:
+        raise ValueError("Expansion requires a Vocabulary prompt with a 'Vocabulary range'.")
+    existing_html = strip_code_fences(existing_html)
+
+    plan = expansion_plan(existing_html, targets)
+    new_rows_html = ""
+    llm_call = any(delta > 0 for delta in plan.values())
+    if llm_call:
+        used = _collect_span_es_words(existing_html, limit=1000)
+        added = sum(delta for delta in plan.values() if delta > 0)
+        completion = routed_completion(
+            client,
+            route or ("small" if added <= SMALL_JOB_MAX_ITEMS else "full"),
+            messages=[
+                {"role": "system", "content": base_system},
+                {"role": "user", "content": build_expansion_prompt(parse_topic(prompt), plan, used)},
+            ],
+            temperature=0.7,
+            max_tokens=max_tokens,
+        )
+        new_rows_html = normalize_highlights(strip_code_fences(completion.choices[0].message.content))
+
+    html = apply_expansion(existing_html, new_rows_html, plan)
+    return html, {"plan": plan, "llm_call": llm_call}
+
+
+# -----------------------
+# Verify & repair one generated Vocabulary document
+# -----------------------
+
+def validate_vocab_document(prompt: str, html: str):
+    """Validation report of a finished document against its prompt (no repair), or None if not applicable."""
+    targets = vocab_targets(prompt)
+    if not targets:
+        return None
+    report = build_validation_report(html, targets.quotas, targets.rows_minmax, targets.selected)
+    report["discourse"] = {title: {"ok": not issues, "issues": issues, "retried": False}
+                           for title, issues in validate_discourse_sections(html).items()}
+    return report
+
+
+def _has_section_tables(full_html: str, selected: set) -> bool:
+    """True when every selected resizable section has a <tbody> that rows can be spliced into."""
+    return all(_tbody_spans(_extract_section_body(full_html, rx))
+               for sel_key, _key, rx, _title in _RESIZABLE_SECTIONS if sel_key in selected)
+
+
+def finalize_vocab_document(client, base_system: str, system_message: str, prompt: str, ai_content: str,
+                            max_tokens: int, repair: bool = True):
+    """
+    One-shot verify & fix (Vocabulary only, respecting selected sections), the Common-rows
+    guarantee and section-only discourse retries, for one normalized document.
+    Wrong counts are fixed with a targeted top-up (missing rows requested, extra rows trimmed locally)
+    when every selected section is present, and by a full-prompt repair only when one is missing.
+    repair=False (expand/assemble: the document was just resized) only verifies.
+    Returns (html, extras) where extras may hold "validation", "top_up" and "repair_generation".
+    """
+    extras = {}
+    targets = vocab_targets(prompt)
+    if not targets:
+        return ai_content, extras
+
+    lo, hi, selected, selected_nvda = targets.lo, targets.hi, targets.selected, targets.selected_nvda
+    selected_phr = 'phrases' in selected
+    selected_q = 'questions' in selected
+
+    quotas_map = targets.quotas
+    quotas = (quotas_map['n'], quotas_map['v'], quotas_map['a'], quotas_map['d'])
+    rows_min, rows_max = targets.rows_minmax
+
+    counts = verify_vocab_counts_selected(ai_content, selected_nvda, selected_phr, selected_q)
+    repaired = repair and needs_repair_selected(counts, quotas, targets.rows_minmax, selected_nvda, selected_phr, selected_q)
+    if repaired and _has_section_tables(ai_content, selected):
+        ai_content, extras["top_up"] = run_expansion(client, base_system, prompt, ai_content, max_tokens,
+                                                     route=classify_task(targets, repair=True))
+    elif repaired:
+        repair_block = build_repair_prompt_selected(lo, hi, quotas, rows_min, selected_nvda, selected_phr, selected_q)
+        repaired_content, extras["repair_generation"] = complete_with_continuation(
+            client,
+            "full",  # a whole new document, not a single-section repair
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt + "\n" + repair_block},
+            ],
+            temperature=0.7,
+            max_tokens=max_tokens,
+        )
+        # Re-apply color normalization
+        ai_content = normalize_highlights(strip_code_fences(repaired_content))
+
+    # FINAL GUARANTEE: ensure Common Phrases/Questions ≥ 8 rows (≤10), only if selected; without touching NVAD counts.
+    before = verify_vocab_counts_selected(ai_content, set(), selected_phr, selected_q)
+    ai_content = _ensure_common_minimum_selected(
+        ai_content,
+        min_rows=rows_min,
+        max_rows=rows_max,
+        selected_phr=selected_phr,
+        selected_q=selected_q
+    )
+    after = verify_vocab_counts_selected(ai_content, set(), selected_phr, selected_q)
+    filler = {}
+    if selected_phr: filler["phrases"] = after["phr_rows"] - before["phr_rows"]
+    if selected_q: filler["questions"] = after["q_rows"] - before["q_rows"]
+
+    # Conversations / Monologue (when the model produced them): section-only retries, never a full redo
+    ai_content, discourse = retry_failing_discourse_sections(client, base_system, prompt, ai_content, max_tokens)
+
+    extras["validation"] = build_validation_report(
+        ai_content, quotas_map, targets.rows_minmax, selected,
+        initial_counts=counts, repair_performed=repaired, filler_rows=filler,
+    )
+    extras["validation"]["discourse"] = discourse
+    return ai_content, extras
+
+
+# -----------------------
+# Packed generation (several small topics in one completion, sharing one system prompt)
+# -----------------------
+
+PACKED_MAX_TOPICS = int(os.getenv("PACKED_MAX_TOPICS", "4"))
+PACK_MARK_RE = re.compile(r'<!--\s*FCS\s+TOPIC\s+(\d+)\s+(BEGIN|END)\s*-->', re.IGNORECASE)
+PROMPT_COMMENT_RE = re.compile(r'<!--[\s\S]*?-->')
+
+
+def _prompt_skeleton(prompt: str) -> str:
+    """The HTML skeleton of a Vocabulary prompt, without its instruction comment."""
+    return PROMPT_COMMENT_RE.sub("", prompt, count=1).strip()
+
+
+def build_packed_prompt(prompts) -> str:
+    """
+    One user message for several topics: the first prompt carries the full instructions,
+    every other topic contributes only its skeleton. Documents come back between delimiters.
+    """
+    k = len(prompts)
+    parts = [
+        "<!-- FCS PACKED REQUEST",
+        f"Produce {k} SEPARATE, COMPLETE Vocabulary HTML documents, one per topic below, in this order.",
+        "Apply the instructions of the FIRST prompt to EVERY topic, using each topic's own title.",
+        "Wrap each document EXACTLY between its delimiters, with nothing between documents:",
+        "  <!-- FCS TOPIC 1 BEGIN --> …document 1… <!-- FCS TOPIC 1 END -->",
+        f"  … up to <!-- FCS TOPIC {k} END -->",
+        "Topics are independent: every document meets its own quotas; do not reuse vocabulary across topics.",
+        "-->",
+        f"<!-- TOPIC 1: “{parse_topic(prompts[0])}” -->",
+        prompts[0],
+    ]
+    for i, p in enumerate(prompts[1:], 2):
+        parts += [f"<!-- TOPIC {i}: “{parse_topic(p)}” — skeleton -->", _prompt_skeleton(p)]
+    return "\n".join(parts)
+
+
+def split_packed_output(text: str, k: int):
+    """Per-topic documents in order; None where a topic's delimiters are missing or empty."""
+    parts, opened = [None] * k, {}
+    for m in PACK_MARK_RE.finditer(text or ""):
+        i = int(m.group(1)) - 1
+        if not 0 <= i < k:
+            continue
+        if m.group(2).upper() == "BEGIN":
+            opened[i] = m.end()
+        elif i in opened:
+            parts[i] = strip_code_fences(text[opened.pop(i):m.start()]) or None
+    return parts
+
+
+def plan_packs(estimates, cap: int):
+    """Group topic indexes so each pack's predicted output (with headroom) fits one completion."""
+    packs, cur, cur_tokens = [], [], 0
+    for i, est in enumerate(estimates):
+        need = est["predicted_tokens"] * SIZE_HEADROOM
+        if cur and (len(cur) >= PACKED_MAX_TOPICS or cur_tokens + need > cap):
+            packs.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(i)
+        cur_tokens += need
+    if cur:
+        packs.append(cur)
+    return packs
+
+
+def run_packed(client, base_system: str, prompts, cap: int):
+    """
+    Generate several small-range Vocabulary documents with as few completions as fit the token cap.
+    Prompts must share range and sections (so they share one system message); only topics differ.
+    Each returned document is normalized and verified on its own (per-topic repair); a topic missing
+    from the packed reply is generated alone. Returns {"documents": [...], "packing": {...}}.
+    """
+    if not prompts:
+        raise ValueError("Packed mode needs a non-empty 'prompts' list.")
+    if len(prompts) > 4 * PACKED_MAX_TOPICS:
+        raise ValueError(f"Packed mode takes at most {4 * PACKED_MAX_TOPICS} topics per request.")
+    estimates = [estimate_generation(p, cap) for p in prompts]
+    if not all(estimates):
+        raise ValueError("Packed mode only accepts Vocabulary prompts with a range.")
+    if any(e["route"] != "small" for e in estimates):
+        raise ValueError(f"Packed mode is for small ranges (at most {SMALL_JOB_MAX_ITEMS} items per topic).")
+    shape = {cache_shape(vocab_targets(p)) for p in prompts}
+    if len(shape) > 1:
+        raise ValueError("Packed topics must share the same range and sections.")
+
+    system_message = build_system_message(base_system, prompts[0])
+    documents = [None] * len(prompts)
+    packs = plan_packs(estimates, cap)
+    calls = 0
+    for pack in packs:
+        predicted = sum(estimates[i]["predicted_tokens"] for i in pack)
+        started = time.perf_counter()
+        if len(pack) == 1:
+            parts = [None]
+            gen = {"prompt_tokens": 0, "completion_tokens": 0}
+        else:
+            text, gen = complete_with_continuation(
+                client,
+                "small",
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": build_packed_prompt([prompts[i] for i in pack])},
+                ],
+                temperature=0.8,
+                max_tokens=adaptive_max_tokens(predicted, cap),
+            )
+            calls += 1 + gen["continuations"]
+            parts = split_packed_output(text, len(pack))
+        pack_ms = (time.perf_counter() - started) * 1000
+        total_chars = sum(len(p) for p in parts if p) or 1
+
+        for part, i in zip(parts, pack):
+            t0 = time.perf_counter()
+            doc = {"topic": parse_topic(prompts[i]), "packed": part is not None}
+            if part is None:
+                # Missing from the packed reply (or a pack of one): generate this topic alone
+                part, alone = complete_with_continuation(
+                    client,
+                    "small",
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": prompts[i]},
+                    ],
+                    temperature=0.8,
+                    max_tokens=estimates[i]["max_tokens"],
+                )
+                calls += 1 + alone["continuations"]
+                part = strip_code_fences(part)
+                usage = {"prompt_tokens": alone["prompt_tokens"], "completion_tokens": alone["completion_tokens"]}
+                gen_ms = (time.perf_counter() - t0) * 1000
+            else:
+                # Shared call: prompt tokens and time split evenly, completion tokens by output share
+                share = len(part) / total_chars
+                usage = {"prompt_tokens": round(gen["prompt_tokens"] / len(pack)),
+                         "completion_tokens": round(gen["completion_tokens"] * share)}
+                gen_ms = pack_ms / len(pack)
+            t1 = time.perf_counter()
+            html, extras = finalize_vocab_document(client, base_system, system_message, prompts[i],
+                                                   normalize_highlights(part), estimates[i]["max_tokens"])
+            doc.update(extras, content=html, metrics=dict(
+                usage, generation_ms=round(gen_ms, 1), verify_repair_ms=round((time.perf_counter() - t1) * 1000, 1)))
+            documents[i] = doc
+
+    per_topic = [d["metrics"] for d in documents]
+    n = len(documents)
+    return {
+        "documents": documents,
+        "packing": {
+            "topics": n,
+            "packs": [len(p) for p in packs],
+            "generation_calls": calls,
+            "avg_prompt_tokens_per_topic": round(sum(m["prompt_tokens"] for m in per_topic) / n, 1),
+            "avg_completion_tokens_per_topic": round(sum(m["completion_tokens"] for m in per_topic) / n, 1),
+            "avg_generation_ms_per_topic": round(sum(m["generation_ms"] for m in per_topic) / n, 1),
+        },
+    }
+
+
+# -----------------------
+# Fuzzy topic cache (near-duplicate topics reuse a stored document instead of calling the model)
+# -----------------------
+
+# Unset = disabled. On Vercel use a writable path such as /tmp/fcs-topic-cache (per instance).
+TOPIC_CACHE_DIR = os.getenv("TOPIC_CACHE_DIR")
+# Singular/plural and article variants already share a key; this admits typos ("Pool equipmnt", 0.83)
+# and wider wordings ("Swimming pool equipment" vs "Pool equipment", 0.72) while letter-sharing topics
+# ("Pool party" vs "Pool", 0.62; "Beach" vs "Bleach", 0.62) stay below. Near misses above it
+# ("Cooking class" vs "Cooking", 0.73) are caught by the confirmation step, which is on by default.
+# scripts/check_topic_match.py checks known pairs against the configured value.
+TOPIC_MATCH_THRESHOLD = float(os.getenv("TOPIC_MATCH_THRESHOLD", "0.7"))
+# Non-exact matches are offered to the user first unless this is "0"
+TOPIC_CACHE_CONFIRM = os.getenv("TOPIC_CACHE_CONFIRM", "1") != "0"
+
+TOPIC_WORD_RE = re.compile(r"[a-z0-9ñü]+")
+_TOPIC_STOPWORDS = {
+    "the", "a", "an", "of", "and", "for", "in", "at", "on", "to", "with",
+    "el", "la", "los", "las", "un", "una", "de", "del", "y", "en", "con", "para",
+}
+
+
+def _stem(word: str) -> str:
+    """
+    Plural → singular so both spellings share one key: classes → class, lunches → lunch,
+    cities → city, tables → table, playas → playa; 'glass' and 'bus' are left alone.
+    """
+    if len(word) <= 3 or word.endswith("ss") or not word.endswith("s"):
+        return word
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("es") and word[:-2].endswith(("s", "x", "z", "ch", "sh")):
+        return word[:-2]
+    return word[:-1]
+
+
+def normalize_topic_key(topic: str) -> str:
+    """'  At the Pool Equipments ' and 'pool équipment' → 'pool equipment'."""
+    words = TOPIC_WORD_RE.findall((topic or "").translate(_VOWEL_MAP).lower())
+    return " ".join(_stem(w) for w in words if w not in _TOPIC_STOPWORDS)
+
+
+def _trigrams(key: str):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def topic_similarity(a: str, b: str) -> float:
+    """Dice coefficient over character trigrams of the normalized keys (1.0 = same key)."""
+    ka, kb = normalize_topic_key(a), normalize_topic_key(b)
+    if ka == kb:
+        return 1.0
+    ga, gb = _trigrams(ka), _trigrams(kb)
+    return 2 * len(ga & gb) / (len(ga) + len(gb))
+
+
+def cache_shape(targets) -> str:
+    """Documents are only interchangeable for the same range and sections."""
+    return f"{targets.lo}-{targets.hi}|{','.join(sorted(targets.selected))}"
+
+
+class TopicCache:
+    """
+    Verified documents on local disk plus an in-memory trigram index over their topics.
+    index.json lists {"id", "topic", "key", "shape", "saved_at"}; each document is <id>.html.
+    The index is re-read only when index.json changes, so other workers' writes are picked up.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self._mtime = None
+        self._entries = []
+        self._postings = {}  # trigram -> set of entry positions
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        entries = []
+        if mtime is not None:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        self._entries, self._mtime, self._postings = entries, mtime, {}
+        for pos, e in enumerate(entries):
+            for g in _trigrams(e["key"]):
+                self._postings.setdefault(g, set()).add(pos)
+
+    def lookup(self, topic: str, shape: str, threshold: float = TOPIC_MATCH_THRESHOLD):
+        """Best stored entry with the same shape and similarity ≥ threshold, as dict(entry, similarity)."""
+        self._load()
+        key = normalize_topic_key(topic)
+        grams = _trigrams(key)
+        shared = {}
+        for g in grams:
+            for pos in self._postings.get(g, ()):
+                shared[pos] = shared.get(pos, 0) + 1
+        best, best_score = None, 0.0
+        for pos, n in shared.items():
+            e = self._entries[pos]
+            if e["shape"] != shape:
+                continue
+            score = 1.0 if e["key"] == key else 2 * n / (len(grams) + len(_trigrams(e["key"])))
+            if score > best_score or (score == best_score and best and e["saved_at"] > best["saved_at"]):
+                best, best_score = e, score
+        if best is None or best_score < threshold:
+            return None
+        return dict(best, similarity=round(best_score, 3))
+
+    def read(self, entry) -> str:
+        with open(os.path.join(self.root, entry["id"] + ".html"), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put(self, topic: str, shape: str, html: str):
+        self._load()
+        key = normalize_topic_key(topic)
+        entry_id = hashlib.sha1(f"{key}|{shape}".encode("utf-8")).hexdigest()[:16]
+        os.makedirs(self.root, exist_ok=True)
+        _write_atomic(os.path.join(self.root, entry_id + ".html"), html)
+        entries = [e for e in self._entries if e["id"] != entry_id]
+        entries.append({"id": entry_id, "topic": topic, "key": key, "shape": shape, "saved_at": time.time()})
+        _write_atomic(self.index_path, json.dumps(entries, ensure_ascii=False))
+        self._mtime = None
+        return entry_id
+
+
+def _write_atomic(path: str, text: str):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+_TOPIC_CACHE = None
+
+
+def topic_cache():
+    """The process-wide TopicCache, or None when TOPIC_CACHE_DIR is unset."""
+    global _TOPIC_CACHE
+    if TOPIC_CACHE_DIR and _TOPIC_CACHE is None:
+        _TOPIC_CACHE = TopicCache(TOPIC_CACHE_DIR)
+    return _TOPIC_CACHE
+
+
+# -----------------------
+# Row-level vocabulary bank (verified rows in sqlite; new documents assembled from it first)
+# -----------------------
+
+# Unset = disabled. On Vercel use a writable path such as /tmp/fcs-vocab-bank.sqlite (per instance).
+VOCAB_BANK_PATH = os.getenv("VOCAB_BANK_PATH")
+# Rows from other topics are reused without asking only when their topic is at least this similar
+# (spelling variants). Trigram scores in between are weak evidence ("Beach" vs "Bleach" is 0.62,
+# "Car repair" vs "Car rental" 0.55), so topics ≥ VOCAB_BANK_SUGGEST are offered as candidates and
+# their rows are used only once the caller confirms them ("bank_topics").
+VOCAB_BANK_MATCH = float(os.getenv("VOCAB_BANK_MATCH", "0.8"))
+VOCAB_BANK_SUGGEST = float(os.getenv("VOCAB_BANK_SUGGEST", "0.5"))
+VOCAB_BANK_CANDIDATES = 500
+
+_BANK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bank_rows (
+    id INTEGER PRIMARY KEY,
+    topic TEXT NOT NULL,
+    topic_key TEXT NOT NULL,
+    section TEXT NOT NULL,
+    es_text TEXT NOT NULL,
+    row_html TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    UNIQUE (topic_key, section, es_text)
+);
+CREATE INDEX IF NOT EXISTS bank_rows_by_topic ON bank_rows (topic_key, section);
+"""
+
+
+def _row_es_text(sel_key: str, row_html: str):
+    """
+    Spanish target of a bankable row as written (lowercased): the single ES span for NVAD rows,
+    the whole Spanish cell for Common rows. None for header rows and rows that would break the counts.
+    """
+    tds = _get_cells(row_html)
+    if len(tds) < 2:
+        return None
+    if sel_key in ('phrases', 'questions'):
+        return _cell_text(tds[1].group(1)).lower() or None
+    spans = list(ES_SPAN_RE.finditer(tds[1].group(0)))
+    if len(spans) != 1 or _count_es_spans(row_html) != 1:
+        return None
+    return WS_RE.sub(" ", _span_text(spans[0])).strip().lower() or None
+
+
+class VocabBank:
+    """
+    Every verified row, tagged by topic, section and Spanish target text (sqlite). Similar topics
+    are found like in TopicCache: trigram postings over the distinct topic keys, then topic_similarity.
+    """
+
+    def __init__(self, path: str):
+        import sqlite3  # only paid for when the bank is enabled
+
+        self.db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.db.executescript(_BANK_SCHEMA)
+        self.db.commit()
+        self._version = None
+        self._postings = {}  # trigram -> set of topic keys
+
+    def _load_keys(self):
+        """Rebuild the topic-key postings when any connection has written since the last build."""
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._version:
+            return
+        self._postings = {}
+        for (key,) in self.db.execute("SELECT DISTINCT topic_key FROM bank_rows"):
+            self._index_key(key)
+        self._version = version
+
+    def _index_key(self, key: str):
+        for g in _trigrams(key):
+            self._postings.setdefault(g, set()).add(key)
+
+    def similar_keys(self, key: str, threshold: float = VOCAB_BANK_MATCH):
+        """(similarity, topic key) of stored keys ≥ threshold, most similar first (the key itself first)."""
+        self._load_keys()
+        grams = _trigrams(key)
+        shared = {}
+        for g in grams:
+            for other in self._postings.get(g, ()):
+                shared[other] = shared.get(other, 0) + 1
+        scored = [(1.0 if other == key else 2 * n / (len(grams) + len(_trigrams(other))), other)
+                  for other, n in shared.items()]
+        return [(score, other) for score, other in sorted(scored, key=lambda t: (-t[0], t[1])) if score >= threshold]
+
+    def _topic_of(self, key: str) -> str:
+        """Latest topic as typed for a stored key (for showing candidates)."""
+        row = self.db.execute("SELECT topic FROM bank_rows WHERE topic_key = ? ORDER BY saved_at DESC LIMIT 1",
+                              (key,)).fetchone()
+        return row[0] if row else key
+
+    def ingest(self, topic: str, full_html: str, selected: set, exclude=frozenset()) -> int:
+        """
+        Store the rows of every selected section; returns the number of new rows.
+        exclude holds (section, es_text) of rows borrowed from other topics, which stay filed under theirs.
+        """
+        key, now, added = normalize_topic_key(topic), time.time(), 0
+        for sel_key, _key, rx, _title in _RESIZABLE_SECTIONS:
+            if sel_key not in selected:
+                continue
+            for row in _section_rows(full_html, rx):
+                es_text = _row_es_text(sel_key, row)
+                if es_text and (sel_key, es_text) not in exclude:
+                    added += self.db.execute(
+                        "INSERT OR IGNORE INTO bank_rows (topic, topic_key, section, es_text, row_html, saved_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", (topic, key, sel_key, es_text, row.strip(), now)).rowcount
+        self.db.commit()
+        if added:
+            self._index_key(key)  # our own commit does not change this connection's data_version
+        return added
+
+    def _candidates(self, keys, section: str):
+        """(topic_key, es_text, row_html) rows of this section from the given topic keys, in that order."""
+        if not keys:
+            return []
+        rank = {k: i for i, k in enumerate(keys)}
+        rows = self.db.execute(
+            f"SELECT topic_key, es_text, row_html, saved_at FROM bank_rows "
+            f"WHERE section = ? AND topic_key IN ({','.join('?' * len(keys))})", (section, *keys)).fetchall()
+        rows.sort(key=lambda r: (rank[r[0]], -r[3]))
+        return [r[:3] for r in rows]
+
+    def assemble(self, prompt: str, confirmed=()):
+        """
+        Fill the prompt's skeleton from the bank: each selected section up to its quota (NVAD) or
+        minimum rows (Common), never repeating a Spanish target within the document.
+        Rows come from the same topic key, keys ≥ VOCAB_BANK_MATCH and the candidate keys in 'confirmed'.
+        Returns (html, {"rows": {section: rows_taken}, "candidates": [...]}, borrowed) where candidates
+        are the unconfirmed keys ≥ VOCAB_BANK_SUGGEST and borrowed the (section, es_text) of rows
+        taken from other topic keys.
+        """
+        targets = vocab_targets(prompt)
+        if not targets:
+            raise ValueError("Assemble mode requires a Vocabulary prompt with a 'Vocabulary range'.")
+        key = normalize_topic_key(parse_topic(prompt))
+        keys, candidates = [], []
+        for score, other in self.similar_keys(key, min(VOCAB_BANK_SUGGEST, VOCAB_BANK_MATCH)):
+            if score >= VOCAB_BANK_MATCH or other in confirmed:
+                keys.append(other)
+            else:
+                candidates.append({"key": other, "topic": self._topic_of(other), "similarity": round(score, 3)})
+
+        html, taken, used, borrowed = _prompt_skeleton(prompt), {}, set(), set()
+        for sel_key, count_key, rx, _title in _RESIZABLE_SECTIONS:
+            if sel_key not in targets.selected:
+                continue
+            want = targets.rows_minmax[0] if count_key in ('phr_rows', 'q_rows') else targets.quotas[count_key]
+            rows = []
+            for topic_key, es_text, row_html in self._candidates(keys[:VOCAB_BANK_CANDIDATES], sel_key):
+                if len(rows) >= want:
+                    break
+                if es_text not in used:
+                    used.add(es_text)
+                    rows.append(row_html)
+                    if topic_key != key:
+                        borrowed.add((sel_key, es_text))
+            if rows:
+                html = _inject_rows_into_section(html, rx, "".join(rows))
+            taken[sel_key] = len(rows)
+        return html, {"rows": taken, "candidates": candidates}, borrowed
+
+
+_VOCAB_BANK = None
+
+
+def vocab_bank():
+    """The process-wide VocabBank, or None when VOCAB_BANK_PATH is unset."""
+    global _VOCAB_BANK
+    if VOCAB_BANK_PATH and _VOCAB_BANK is None:
+        _VOCAB_BANK = VocabBank(VOCAB_BANK_PATH)
+    return _VOCAB_BANK
+
+
+# -----------------------
+# Fill-in-the-blank worksheets (deterministic transform of a finished document; no model call)
+# -----------------------
+
+EN_SPAN_RE = re.compile(r'<span\s+class="en">([^<]+)</span>', _I)
+BODY_OPEN_RE = re.compile(r'<body\b[^<>]*>', _I)
+TITLE_TAG_RE = re.compile(r'<title>[^<]*</title>', _I)
+FIB_SECTIONS = _RESIZABLE_SECTIONS[:4]  # NVAD: the only sections with aligned en/es targets
+FIB_MAX_DOCUMENTS = 50
+CACHE_ID_RE = re.compile(r"[0-9a-f]{16}")  # TopicCache entry ids (sha1 prefix); also keeps paths inside the cache dir
+
+
+def _fib_row(row_html: str):
+    """
+    (worksheet row, answer-key row, (english, spanish)) for a row with exactly one EN and one ES
+    target; the Spanish target becomes its English translation in parentheses. None otherwise.
+    """
+    tds = _get_cells(row_html)
+    if len(tds) < 2:
+        return None
+    en_spans = list(EN_SPAN_RE.finditer(tds[0].group(1)))
+    es_spans = list(ES_SPAN_RE.finditer(tds[1].group(1)))
+    if len(en_spans) != 1 or len(es_spans) != 1:
+        return None
+    english = WS_RE.sub(" ", en_spans[0].group(1)).strip()
+    spanish = WS_RE.sub(" ", _span_text(es_spans[0])).strip()
+    es_cell = tds[1].group(0)
+    blank = ES_SPAN_RE.sub(lambda _m: f"({english})", es_cell, count=1)
+    start, end = tds[1].span()
+    return row_html[:start] + blank + row_html[end:], row_html, (english, spanish)
+
+
+def _numbered(row_html: str, n: int) -> str:
+    """Prefix the English cell's text with the item number."""
+    inner_start = next(_element_spans(row_html, 'td'))[1]
+    return f"{row_html[:inner_start]}{n}. {row_html[inner_start:]}"
+
+
+def _fib_section_html(title: str, rows) -> str:
+    # Same section skeleton the front end sends in the prompt
+    return (f'<div class="section"><h2>{title}</h2><table class="tbl"><thead><tr><th>English</th>'
+            f'<th lang="es">Español</th></tr></thead><tbody>{"".join(rows)}</tbody></table></div>')
+
+
+def _fib_document(html: str, title: str, heading: str, sections: str) -> str:
+    """Reuse the source document's <head> (styles) with a new title; fall back to a bare page."""
+    body = BODY_OPEN_RE.search(html)
+    head = html[:body.start()] if body else '<!DOCTYPE html><html><head><meta charset="utf-8"></head>'
+    head = TITLE_TAG_RE.sub(lambda _m: f"<title>{html_lib.escape(title)}</title>", head, count=1)
+    return (f'{head}<body><div class="fcs-doc"><h1>{html_lib.escape(heading)}</h1>'
+            f'{sections}</div></body></html>')
+
+
+def build_fib_worksheet(html: str) -> dict:
+    """
+    Worksheet + answer key from the aligned <span class="en">/<span class="es"> pairs of the NVAD
+    sections. Items are numbered across sections in document order; rows without exactly one pair
+    are left out (counted in "skipped"), and subcategory header rows are kept only above a kept item.
+    """
+    html = normalize_highlights(strip_code_fences(html or ""))
+    topic = html_lib.unescape(parse_topic(html))  # <title> text is already HTML; escaped once when written back
+    sheet_sections, key_sections, answers, skipped = [], [], [], 0
+    for _sel_key, _key, rx, title in FIB_SECTIONS:
+        sheet_rows, key_rows, pending = [], [], []
+        for row in _section_rows(html, rx):
+            item = _fib_row(row)
+            if item is None:
+                if _count_es_spans(row):
+                    skipped += 1
+                else:
+                    pending.append(row)
+                continue
+            n = len(answers) + 1
+            sheet_rows.extend(pending); key_rows.extend(pending); pending = []
+            sheet_rows.append(_numbered(item[0], n))
+            key_rows.append(_numbered(item[1], n))
+            answers.append({"n": n, "section": title, "english": item[2][0], "spanish": item[2][1]})
+        if sheet_rows:
+            sheet_sections.append(_fib_section_html(title, sheet_rows))
+            key_sections.append(_fib_section_html(title, key_rows))
+    return {
+        "topic": topic,
+        "worksheet": _fib_document(html, f"Fill in the Blank — {topic}", f"Fill in the Blank: {topic}",
+                                   "".join(sheet_sections)),
+        "answer_key": _fib_document(html, f"Answer Key — {topic}", f"Answer Key: {topic}",
+                                    "".join(key_sections)),
+        "answers": answers,
+        "items": len(answers),
+        "skipped": skipped,
+    }
+
+
+def fib_sources(data: dict):
+    """(label, html) pairs from 'document', 'documents' and/or 'cache_ids' (topic cache entries)."""
+    sources = []
+    if isinstance(data.get("document"), str) and data["document"].strip():
+        sources.append(("document", data["document"]))
+    for i, doc in enumerate(data.get("documents") or []):
+        if isinstance(doc, str) and doc.strip():
+            sources.append((f"documents[{i}]", doc))
+    ids = [i for i in (data.get("cache_ids") or []) if isinstance(i, str) and i]
+    if ids:
+        cache = topic_cache()
+        if not cache:
+            raise ValueError("cache_ids need TOPIC_CACHE_DIR to be configured.")
+        for entry_id in ids:
+            if not CACHE_ID_RE.fullmatch(entry_id):
+                raise ValueError(f"Invalid cache id: {entry_id!r}")
+            try:
+                sources.append((entry_id, cache.read({"id": entry_id})))
+            except FileNotFoundError:
+                raise ValueError(f"Unknown cache id: {entry_id}")
+    if not sources:
+        raise ValueError("Missing 'document', 'documents' or 'cache_ids' for fib mode.")
+    if len(sources) > FIB_MAX_DOCUMENTS:
+        raise ValueError(f"At most {FIB_MAX_DOCUMENTS} documents per fib request.")
+    return sources
+
+
+# -----------------------
+# On-demand request profiling (CPU + allocations; off unless sampled or asked for with the secret header)
+# -----------------------
+
+# Where .prof artifacts and their summaries go (inspect with: python -m pstats <file>.prof)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/fcs-profiles")
+# Fraction of POSTs profiled without asking, e.g. "0.01"; 0 = only on request
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# A request carrying "X-FCS-Profile: <secret>" is always profiled; unset = header ignored
+PROFILE_SECRET = os.getenv("PROFILE_SECRET")
+PROFILE_HEADER = "X-FCS-Profile"
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+
+
+def should_profile(headers) -> bool:
+    if PROFILE_SECRET:
+        import hmac
+        if hmac.compare_digest((headers.get(PROFILE_HEADER) or "").encode(), PROFILE_SECRET.encode()):
+            return True
+    if PROFILE_SAMPLE_RATE > 0:
+        import random
+        return random.random() < PROFILE_SAMPLE_RATE
+    return False
+
+
+def _fn_label(key) -> str:
+    filename, line, name = key
+    if filename == "~":
+        return name  # builtins, e.g. "<method 'sub' of 're.Pattern' objects>"
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def _profile_summary(stats, snapshot, peak: int, top_n: int) -> dict:
+    """Hot functions by own time (with their heaviest caller, to tell which fix_* runs a regex) and top allocation sites."""
+    hot = []
+    for key, (_cc, calls, tottime, cumtime, callers) in sorted(stats.stats.items(), key=lambda kv: -kv[1][2])[:top_n]:
+        caller = max(callers.items(), key=lambda kv: kv[1][2], default=None)
+        hot.append({"function": _fn_label(key), "calls": calls, "own_ms": round(tottime * 1000, 2),
+                    "cum_ms": round(cumtime * 1000, 2), "top_caller": _fn_label(caller[0]) if caller else None})
+    allocs = []
+    if snapshot is not None:
+        import tracemalloc
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+        for stat in snapshot.statistics("lineno")[:top_n]:
+            frame = stat.traceback[0]
+            allocs.append({"site": f"{os.path.basename(frame.filename)}:{frame.lineno}",
+                           "kib": round(stat.size / 1024, 1), "blocks": stat.count})
+    return {"total_ms": round(stats.total_tt * 1000, 2), "peak_kib": round(peak / 1024, 1),
+            "hot_functions": hot, "allocations": allocs}
+
+
+def profile_call(fn, label: str = "request"):
+    """Run fn() under cProfile and tracemalloc; write <id>.prof and <id>.json to PROFILE_DIR and log one PROFILE line.
+    Profiling problems are logged and never fail the request itself."""
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    own_tracing = not tracemalloc.is_tracing()
+    if own_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    prof = cProfile.Profile()
+    started = time.time()
+    try:
+        return prof.runcall(fn)
+    finally:
+        snapshot = tracemalloc.take_snapshot() if own_tracing else None
+        peak = tracemalloc.get_traced_memory()[1]
+        if own_tracing:
+            tracemalloc.stop()
+        try:
+            run_id = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(started))}-{int(started * 1000) % 1000:03d}-{os.getpid()}-{label}"
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            base = os.path.join(PROFILE_DIR, run_id)
+            prof.dump_stats(base + ".prof")
+            summary = dict(_profile_summary(pstats.Stats(prof), snapshot, peak, PROFILE_TOP_N),
+                           id=run_id, wall_ms=round((time.time() - started) * 1000, 1))
+            _write_atomic(base + ".json", json.dumps(summary, indent=2))
+            print("PROFILE " + json.dumps({"id": run_id, "wall_ms": summary["wall_ms"], "peak_kib": summary["peak_kib"],
+                                           "hot": [h["function"] for h in summary["hot_functions"][:5]]}))
+        except Exception as e:
+            print(f"PROFILE FAILED: {e}")
+
+
 # -----------------------
 # HTTP Handler
 # -----------------------
@@ -867,21 +2649,34 @@ class handler(BaseHTTPRequestHandler):
     def _send_cors_headers(self):
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS, GET")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Allow-Headers", f"Content-Type, {PROFILE_HEADER}")
 
     def do_OPTIONS(self):
         self.send_response(204)
         self._send_cors_headers()
         self.end_headers()
 
-    def do_GET(self):
-        self.send_response(200)
+    def _send_json(self, payload, status: int = 200):
+        self.send_response(status)
         self._send_cors_headers()
         self.send_header("Content-type", "application/json; charset=utf-8")
         self.end_headers()
-        self.wfile.write(json.dumps({"ok": True}).encode("utf-8"))
+        self.wfile.write(json.dumps(payload).encode("utf-8"))
+
+    def do_GET(self):
+        self._send_json({
+            "ok": True,
+            "routes": route_stats_snapshot(),
+            "size_model": size_model_snapshot(),
+        })
 
     def do_POST(self):
+        if should_profile(self.headers):
+            profile_call(self._handle_post, "post")
+        else:
+            self._handle_post()
+
+    def _handle_post(self):
         try:
             content_length = int(self.headers.get("Content-Length", "0"))
             raw = self.rfile.read(content_length) if content_length else b"{}"
@@ -891,21 +2686,63 @@ class handler(BaseHTTPRequestHandler):
             except json.JSONDecodeError:
                 raise ValueError("Invalid JSON in request body.")
 
-            prompt = (data.get("prompt") or "").strip()
+            mode = (data.get("mode") or "").strip().lower()
+            if mode == "fib":
+                # Worksheets + answer keys from finished documents (posted or cached); no prompt, no model call
+                started = time.perf_counter()
+                worksheets = [dict(build_fib_worksheet(doc), source=label) for label, doc in fib_sources(data)]
+                self._send_json({"worksheets": worksheets,
+                                 "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)})
+                return
+
+            prompts = [p.strip() for p in (data.get("prompts") or []) if isinstance(p, str) and p.strip()]
+            prompt = (data.get("prompt") or "").strip() or (prompts[0] if mode == "packed" and prompts else "")
             if not prompt:
                 raise ValueError("Missing 'prompt' in request body.")
 
+            max_tokens = min(int(os.getenv("MODEL_MAX_TOKENS", "10000")), 16384)
+            targets = vocab_targets(prompt)
+            estimate = estimate_generation(prompt, max_tokens)
+            if mode == "estimate":
+                # Size/time prediction only (no model call), so the UI can show it before generating
+                self._send_json({"estimate": estimate})
+                return
+
+            cache = topic_cache() if estimate and mode not in ("expand", "packed") else None
+            if cache and not data.get("skip_cache"):
+                # Near-duplicate topic already generated for this range/sections: no model call at all
+                hit = cache.lookup(parse_topic(prompt), cache_shape(targets))
+                if hit:
+                    info = {"id": hit["id"], "topic": hit["topic"], "similarity": hit["similarity"]}
+                    if hit["similarity"] >= 1.0 or not TOPIC_CACHE_CONFIRM or data.get("use_cached") == hit["id"]:
+                        # Same report as a fresh document, so the client never re-validates (or retries) a cached one
+                        content = cache.read(hit)
+                        self._send_json({"content": content, "cache": dict(info, hit=True),
+                                         "validation": validate_vocab_document(prompt, content)})
+                    else:
+                        self._send_json({"cache_candidate": info})
+                    return
+
+            needs_model = True
+            if mode == "assemble":
+                # --- Assemble from the vocabulary bank first; the model writes only the rows the bank lacks ---
+                bank = vocab_bank()
+                if not bank:
+                    raise ValueError("Assemble mode needs VOCAB_BANK_PATH to be configured.")
+                confirmed = data.get("bank_topics")
+                existing, bank_info, borrowed = bank.assemble(prompt, confirmed if isinstance(confirmed, list) else ())
+                if bank_info["candidates"] and confirmed is None:
+                    # Rows of merely similar topics are offered, never taken silently
+                    self._send_json({"bank_candidates": bank_info["candidates"]})
+                    return
+                needs_model = (any(delta > 0 for delta in expansion_plan(existing, targets).values())
+                               or any(validate_discourse_sections(existing).values()))
+
             api_key = os.environ.get("OPENAI_API_KEY")
-            if not api_key:
+            if needs_model and not api_key:
                 raise ValueError("Server configuration error: OPENAI_API_KEY is not set.")
 
-            client = OpenAI(
-                api_key=api_key,
-                base_url=OPENAI_BASE_URL or None,
-                organization=OPENAI_ORG_ID or None,
-            )
-
-            max_tokens = min(int(os.getenv("MODEL_MAX_TOKENS", "10000")), 16384)
+            client = make_client(api_key) if needs_model else None
 
             # Base system message
             base_system = (
@@ -932,95 +2769,71 @@ class handler(BaseHTTPRequestHandler):
             )
 
             # Build strict system contract for Vocabulary prompts (respecting selected sections)
-            system_message = build_system_message(base_system, prompt)
+            if mode == "packed":
+                # --- Several small topics in one completion, split and verified per topic ---
+                packed = run_packed(client, base_system, prompts, max_tokens)
+                bank = vocab_bank()
+                if bank:
+                    for p, doc in zip(prompts, packed["documents"]):
+                        if doc.get("validation", {}).get("ok"):
+                            doc["bank_rows_added"] = bank.ingest(doc["topic"], doc["content"], parse_selected_sections(p))
+                self._send_json(packed)
+                return
 
-            # --- First generation ---
-            completion = client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o"),
-                temperature=0.8,
-                max_tokens=max_tokens,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": prompt},
-                ],
-            )
-            ai_content = (completion.choices[0].message.content or "").strip()
-
-            # Unwrap code fences if present
-            m = FENCE_RE.match(ai_content)
-            if m:
-                ai_content = m.group(1).strip()
+            system_message = build_system_message(base_system, prompt)
 
-            # Color normalization (does not change structure or quotas intent)
-            ai_content = fix_verbs_highlight(ai_content)
-            ai_content = fix_adverbs_highlight(ai_content)
-            ai_content = ensure_nouns_en_blue_and_parentheses_plain(ai_content)
+            response = {}
+            first_route = estimate["route"] if estimate else "full"
+            if estimate and mode not in ("expand", "assemble"):
+                # Reserve what this document needs instead of the fixed cap
+                max_tokens = estimate["max_tokens"]
+                response["estimate"] = estimate
+            if mode == "expand":
+                # --- Incremental expansion of an existing document (verified below like a fresh one) ---
+                existing = data.get("existing") or ""
+                if not existing.strip():
+                    raise ValueError("Missing 'existing' document for expand mode.")
+                ai_content, response["expansion"] = run_expansion(client, base_system, prompt, existing, max_tokens)
+            elif mode == "assemble":
+                response["bank"] = bank_info
+                ai_content, response["expansion"] = run_expansion(client, base_system, prompt, existing, max_tokens)
+            else:
+                # --- First generation (continued from the last complete row if cut off) ---
+                ai_content, response["generation"] = complete_with_continuation(
+                    client,
+                    first_route,
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=0.8,
+                    max_tokens=max_tokens,
+                )
+                record_size_sample(estimate, response["generation"]["completion_tokens"])
+                # Unwrap code fences if present, then normalize colors
+                ai_content = strip_code_fences(ai_content)
+                ai_content = normalize_highlights(ai_content)
 
             # --- One-shot verify & LLM repair (Vocabulary only, respecting selected sections) ---
-            if IS_VOCAB_RE.search(prompt or ""):
-                lo, hi = parse_vocab_range(prompt)
-                # Handle potential missing bounds
-                if lo is None and hi is not None:
-                    lo = hi
-                if hi is None and lo is not None:
-                    hi = lo
-
-                if lo is not None and hi is not None:
-                    selected = parse_selected_sections(prompt)
-                    selected_nvda = {s for s in selected if s in {'nouns', 'verbs', 'adjectives', 'adverbs'}}
-                    selected_phr = 'phrases' in selected
-                    selected_q = 'questions' in selected
-
-                    target_total = midpoint(lo, hi) if selected_nvda else 0
-                    quotas_map = quotas_by_selection(target_total, selected_nvda)
-                    quotas = (quotas_map['n'], quotas_map['v'], quotas_map['a'], quotas_map['d'])
-                    pmin, _ = phrases_questions_row_targets(target_total)
-
-                    counts = verify_vocab_counts_selected(ai_content, selected_nvda, selected_phr, selected_q)
-                    if needs_repair_selected(counts, quotas, (max(8, pmin), 10), selected_nvda, selected_phr, selected_q):
-                        repair_block = build_repair_prompt_selected(lo, hi, quotas, max(8, pmin), selected_nvda, selected_phr, selected_q)
-                        completion2 = client.chat.completions.create(
-                            model=os.getenv("OPENAI_MODEL", "gpt-4o"),
-                            temperature=0.7,
-                            max_tokens=max_tokens,
-                            messages=[
-                                {"role": "system", "content": system_message},
-                                {"role": "user", "content": prompt + "\n" + repair_block},
-                            ],
-                        )
-                        fixed = (completion2.choices[0].message.content or "").strip()
-                        m2 = FENCE_RE.match(fixed)
-                        if m2:
-                            fixed = m2.group(1).strip()
-                        # Re-apply color normalization
-                        fixed = fix_verbs_highlight(fixed)
-                        fixed = fix_adverbs_highlight(fixed)
-                        fixed = ensure_nouns_en_blue_and_parentheses_plain(fixed)
-                        ai_content = fixed
-
-                    # FINAL GUARANTEE: ensure Common Phrases/Questions ≥ 8 rows (≤10), only if selected; without touching NVAD counts.
-                    ai_content = _ensure_common_minimum_selected(
-                        ai_content,
-                        min_rows=max(8, pmin),
-                        max_rows=10,
-                        selected_phr=selected_phr,
-                        selected_q=selected_q
-                    )
-
-            # Send response
-            self.send_response(200)
-            self._send_cors_headers()
-            self.send_header("Content-type", "application/json; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(json.dumps({"content": ai_content}).encode("utf-8"))
+            ai_content, extras = finalize_vocab_document(client, base_system, system_message, prompt, ai_content,
+                                                         max_tokens, repair=mode not in ("expand", "assemble"))
+            response.update(extras)
+
+            if cache and response.get("validation", {}).get("ok"):
+                response["cache"] = {"hit": False, "id": cache.put(parse_topic(prompt), cache_shape(targets), ai_content)}
+            if vocab_bank() and response.get("validation", {}).get("ok"):
+                # Rows borrowed from other topics stay filed under theirs; only generated rows join this topic
+                response["bank_rows_added"] = vocab_bank().ingest(parse_topic(prompt), ai_content, targets.selected,
+                                                                  exclude=borrowed if mode == "assemble" else frozenset())
+
+            # Send response (with the size model, so the next estimate is computed client-side)
+            response["size_model"] = size_model_snapshot()
+            response["content"] = ai_content
+            self._send_json(response)
 
         except Exception as e:
             print(f"AN ERROR OCCURRED: {e}")
-            self.send_response(500)
-            self._send_cors_headers()
-            self.send_header("Content-type", "application/json; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self._send_json({
                 "error": "An internal server error occurred.",
                 "details": str(e)
-            }).encode("utf-8"))
+            }, status=500)
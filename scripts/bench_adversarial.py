@@ -0,0 +1,128 @@
+"""
+Adversarial-input benchmark for the HTML post-processing in api/index.py.
+
+Model output is untrusted: it can be truncated mid-tag, leave tags unclosed, nest divs,
+run letters or whitespace on without end, or be many times the expected size. This script builds such a corpus, runs the full
+post-processing pass over each case (fence unwrapping, normalization, count verification, validation
+report, discourse checks) and asserts that
+  • every case finishes within a per-case time budget, and
+  • growing a case 10× grows its time roughly linearly, never quadratically.
+Exits non-zero when any assertion fails.
+
+Usage:
+  python scripts/bench_adversarial.py
+  python scripts/bench_adversarial.py --budget-ms 500 --scale 10 --report bench.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index as vocab  # noqa: E402  (api/index.py)
+
+SELECTED = {'nouns', 'verbs', 'adjectives', 'adverbs', 'phrases', 'questions'}
+QUOTAS = {'n': 30, 'v': 20, 'a': 15, 'd': 10}
+# Allowed growth of time(10× input) / time(1× input); quadratic behaviour gives ~100
+MAX_GROWTH = 25.0
+
+
+def _section(title, rows):
+    return (f'<div class="section"><h2>{title}</h2><table class="tbl"><thead><tr><th>English</th>'
+            f'<th lang="es">Español</th></tr></thead><tbody>{"".join(rows)}</tbody></table></div>')
+
+
+def well_formed_doc(k: int = 1) -> str:
+    """A valid document whose vocabulary sections hold k× the usual row count."""
+    nouns = [f'<tr><td>the thing{i}</td><td lang="es">el cosa{i} (la <span class="es">cosa</span>)</td></tr>'
+             for i in range(30 * k)]
+    verbs = [f'<tr><td>He <span class="en">is going to</span> run{i}.</td>'
+             f'<td lang="es"><span class="es">Él va a correr{i}</span>.</td></tr>' for i in range(20 * k)]
+    adjs = [f'<tr><td>It is <span class="en">big{i}</span>.</td><td lang="es">Es muy grande{i}.</td></tr>'
+            for i in range(15 * k)]
+    advs = [f'<tr><td>He runs <span class="en">fast</span>.</td><td lang="es"><span class="es">va a</span> '
+            f'correr rápidamente{i}.</td></tr>' for i in range(10 * k)]
+    common = [f'<tr><td>Phrase {i}.</td><td lang="es">Frase {i}.</td></tr>' for i in range(10 * k)]
+    turns = ['<tr><td>Hi there. How are you?</td><td lang="es">Hola. ¿Cómo estás?</td></tr>'] * (8 * k)
+    return ('<!DOCTYPE html><html><body><div class="fcs-doc"><h1>Vocabulary: Bench</h1>'
+            + _section('Nouns', nouns) + _section('Verbs in Sentences', verbs)
+            + _section('Adjectives', adjs) + _section('Adverbs', advs)
+            + _section('Common Phrases', common) + _section('Common Questions', common)
+            + _section('Conversation 1', turns) + '</div></body></html>')
+
+
+def corpus(n: int):
+    """(name, html) cases; n scales the size of every pathological construct."""
+    base = well_formed_doc(max(1, n // 2000))
+    yield "well_formed", base
+    for frac in (0.1, 0.37, 0.5, 0.81, 0.99):
+        yield f"truncated_{int(frac * 100)}", base[:int(len(base) * frac)]
+    head = '<div class="section"><h2>Nouns</h2><table><tbody>'
+    yield "unclosed_tr", head + '<tr><td>the x</td><td>el <span class="es">y</span>' * n
+    yield "unclosed_td", head + '<tr>' + '<td>el x ' * n
+    yield "unclosed_tbody", '<div class="section"><h2>Nouns</h2>' + '<table><tbody><tr>' * n
+    yield "nested_divs", '<div class="section"><h2>Adverbs</h2>' + '<div>' * n + '<tbody><tr><td>a</td></tr>'
+    yield "unclosed_h2", '<h2>Nouns' * n
+    yield "bare_lt", '<div class="section"><h2>Nouns</h2><tbody><tr><td>' + '<' * (4 * n)
+    yield "lt_no_gt", '<div class="section"><h2>Verbs in Sentences</h2><tbody>' + '<tr class="x' * n
+    yield "long_es_span", ('<div class="section"><h2>Verbs in Sentences</h2><tbody><tr><td>x</td><td>'
+                           '<span class="es">' + 'va a ir ' * n + '</td></tr>')
+    yield "whitespace_span", ('<div class="section"><h2>Nouns</h2><tbody><tr><td>x</td><td>'
+                              '<span class="es">a' + ' ' * (8 * n) + 'b</td></tr>')
+    yield "long_word", ('<div class="section"><h2>Verbs in Sentences</h2><tbody><tr><td>x</td><td>Va a '
+                        + 'a' * (4 * n) + '<b></td></tr>'
+                        + '<tr><td>x</td></tr></tbody></div><div class="section"><h2>Adverbs</h2><tbody><tr><td>x</td><td>'
+                        + 'a' * (4 * n) + '<b></td></tr>')
+    yield "unterminated_fence", '```html\n' + ' ' * (8 * n) + '<div>'
+    yield "dotted_words", ('<div class="section"><h2>Conversation 1</h2><tbody><tr><td>'
+                           + 'a.' * (2 * n) + ' Mr. 3.30 p.m. ' * n + '</td><td>x</td></tr>')
+    yield "many_headings", "".join(f'<div><h2>Conversation {i}</h2></div>' for i in range(n))
+    yield "headings_in_open_div", "".join(f'<div><h2>Conversation {i}</h2><div>' for i in range(n))
+
+
+def run_case(html: str) -> float:
+    started = time.perf_counter()
+    html = vocab.normalize_highlights(vocab.strip_code_fences(html))
+    vocab.build_validation_report(html, QUOTAS, (8, 10), SELECTED)
+    vocab.validate_discourse_sections(html)
+    vocab._ensure_common_minimum_selected(html, 8, 10, True, True)
+    return (time.perf_counter() - started) * 1000
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time post-processing on malformed and oversized model output.")
+    ap.add_argument("--size", type=int, default=2000, help="size of each pathological construct at 1×")
+    ap.add_argument("--scale", type=int, default=10, help="growth factor for the scaling check")
+    ap.add_argument("--budget-ms", type=float, default=1000.0, help="max time for any single case at the large size")
+    ap.add_argument("--report", help="write the JSON results here instead of stdout")
+    args = ap.parse_args(argv)
+
+    small = dict(corpus(args.size))
+    large = dict(corpus(args.size * args.scale))
+    results, failures = [], []
+    for name in small:
+        t_small = min(run_case(small[name]) for _ in range(3))
+        t_large = min(run_case(large[name]) for _ in range(3))
+        # Sub-millisecond timings are noise; only judge growth above that floor
+        growth = t_large / max(t_small, 1.0)
+        row = {"case": name, "bytes": len(large[name]), "small_ms": round(t_small, 2),
+               "large_ms": round(t_large, 2), "growth": round(growth, 1)}
+        if t_large > args.budget_ms:
+            failures.append(f"{name}: {t_large:.0f} ms exceeds budget {args.budget_ms:.0f} ms")
+        if growth > MAX_GROWTH * args.scale / 10:
+            failures.append(f"{name}: {args.scale}× input took {growth:.1f}× longer (superlinear)")
+        results.append(row)
+
+    text = json.dumps({"cases": results, "failures": failures}, indent=2)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Packed vs one-topic-per-call generation: tokens and wall-clock per topic.
+
+Runs the same small-range topics through the API twice — one POST per topic, then one
+POST with mode "packed" — and reports prompt/completion tokens and elapsed time per topic.
+By default a local OpenAI-compatible stub answers with valid documents, counts tokens as
+characters/4 and sleeps RTT + completion_tokens / tokens-per-second, so the numbers show the
+structural saving (the system contract is sent once per pack instead of once per topic).
+With --live the real OPENAI_* environment is used instead.
+
+Usage:
+  python scripts/bench_packed.py --topics 4 --range 20-30
+  python scripts/bench_packed.py --live --topics 3
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+TOPICS = ["Pool", "Kitchen", "Airport", "Garden", "Hospital", "Market", "Library", "Beach"]
+SECTIONS = "nouns,verbs,adjectives,adverbs,phrases,questions"
+
+vocab = None  # api/index.py, imported after the environment is set up
+
+
+def vocab_prompt(topic: str, lo: int, hi: int) -> str:
+    """Same shape as the front end's buildVocabPrompt() (instruction comment + skeleton)."""
+    sec = lambda t: (f'<div class="section"><h2>{t}</h2><table class="tbl"><thead><tr><th>English</th>'
+                     f'<th lang="es">Español</th></tr></thead><tbody></tbody></table></div>')
+    body = "".join(sec(t) for t in ("Nouns", "Verbs in Sentences", "Adjectives", "Adverbs",
+                                    "Common Phrases", "Common Questions"))
+    return (f"<!DOCTYPE html>\n<!-- FCS VOCABULARY OUTPUT\nTopic: {topic}\nVocabulary range: {lo}–{hi} distinct\n"
+            f"  INCLUDE SECTIONS: {SECTIONS}\n-->\n<html><head><title>Vocabulary — {topic}</title></head>"
+            f'<body><div class="fcs-doc"><h1>Vocabulary: {topic}</h1>{body}</div></body></html>')
+
+
+def _stub_document(topic: str, quotas: dict, rows: int) -> str:
+    def section(title, trs):
+        return (f'<div class="section"><h2>{title}</h2><table class="tbl"><tbody>{"".join(trs)}</tbody></table></div>')
+    nouns = [f'<tr><td>the <span class="en">thing</span></td><td lang="es">el <span class="es">cosa</span></td></tr>'] * quotas["n"]
+    verbs = [f'<tr><td>He is going to <span class="en">run</span>.</td><td lang="es">Él va a <span class="es">correr</span>.</td></tr>'] * quotas["v"]
+    adjs = [f'<tr><td>It is <span class="en">big</span>.</td><td lang="es">Es <span class="es">grande</span>.</td></tr>'] * quotas["a"]
+    advs = [f'<tr><td>He runs <span class="en">fast</span>.</td><td lang="es">Corre <span class="es">rápidamente</span>.</td></tr>'] * quotas["d"]
+    common = [f'<tr><td>Phrase.</td><td lang="es">Frase.</td></tr>'] * rows
+    return (f'<!DOCTYPE html><html><head><title>Vocabulary — {topic}</title></head><body><div class="fcs-doc">'
+            f'<h1>Vocabulary: {topic}</h1>' + section("Nouns", nouns) + section("Verbs in Sentences", verbs)
+            + section("Adjectives", adjs) + section("Adverbs", advs) + section("Common Phrases", common)
+            + section("Common Questions", common) + '</div></body></html>')
+
+
+class _StubUpstream(BaseHTTPRequestHandler):
+    rtt_ms = 400.0
+    tokens_per_s = 400.0
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))))
+        user = req["messages"][-1]["content"]
+        lo, hi = vocab.parse_vocab_range(user)
+        target = vocab.midpoint(lo, hi)
+        quotas = vocab.quotas_by_selection(target, {"nouns", "verbs", "adjectives", "adverbs"})
+        rows = max(8, vocab.phrases_questions_row_targets(target)[0])
+        topics = re.findall(r"<title>Vocabulary — (.*?)</title>", user)
+        docs = [_stub_document(t, quotas, rows) for t in topics]
+        if "FCS PACKED REQUEST" in user:
+            content = "\n".join(f"<!-- FCS TOPIC {i} BEGIN -->\n{d}\n<!-- FCS TOPIC {i} END -->"
+                                for i, d in enumerate(docs, 1))
+        else:
+            content = docs[0]
+        prompt_tokens = sum(len(m["content"]) for m in req["messages"]) // 4
+        completion_tokens = len(content) // 4
+        time.sleep((self.rtt_ms + 1000 * completion_tokens / self.tokens_per_s) / 1000)
+        body = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": req["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _post(url: str, payload: dict) -> dict:
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(req) as r:
+        return json.loads(r.read())
+
+
+def main(argv=None):
+    global vocab
+    ap = argparse.ArgumentParser(description="Compare packed and one-topic-per-call generation.")
+    ap.add_argument("--topics", type=int, default=4)
+    ap.add_argument("--range", default="20-30", help="vocabulary range LO-HI (must be a small job)")
+    ap.add_argument("--live", action="store_true", help="call the configured OpenAI endpoint instead of the stub")
+    ap.add_argument("--rtt-ms", type=float, default=400.0, help="stub: fixed latency per call")
+    ap.add_argument("--tokens-per-s", type=float, default=400.0, help="stub: generation speed")
+    args = ap.parse_args(argv)
+    lo, _, hi = args.range.partition("-")
+    lo, hi = int(lo), int(hi or lo)
+
+    stub = None
+    if not args.live:
+        _StubUpstream.rtt_ms, _StubUpstream.tokens_per_s = args.rtt_ms, args.tokens_per_s
+        stub = HTTPServer(("127.0.0.1", 0), _StubUpstream)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        os.environ.update(OPENAI_API_KEY="bench", OPENAI_HTTP_MODE="direct",
+                          OPENAI_BASE_URL=f"http://127.0.0.1:{stub.server_port}/v1")
+    sys.path.insert(0, API_DIR)
+    import index as vocab  # noqa: E402
+
+    api = HTTPServer(("127.0.0.1", 0), vocab.handler)
+    api.RequestHandlerClass.log_message = lambda *a: None
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{api.server_port}/api/index"
+    prompts = [vocab_prompt(TOPICS[i % len(TOPICS)] + ("" if i < len(TOPICS) else f" {i}"), lo, hi)
+               for i in range(args.topics)]
+
+    try:
+        started = time.perf_counter()
+        single = [_post(url, {"prompt": p}) for p in prompts]
+        single_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        packed = _post(url, {"mode": "packed", "prompts": prompts})
+        packed_ms = (time.perf_counter() - started) * 1000
+    finally:
+        api.shutdown()
+        if stub:
+            stub.shutdown()
+
+    n = len(prompts)
+    tok = lambda res, key: res.get("generation", {}).get(key, 0)
+    report = {
+        "topics": n,
+        "range": [lo, hi],
+        "one_per_call": {
+            "prompt_tokens_per_topic": round(sum(tok(r, "prompt_tokens") for r in single) / n, 1),
+            "completion_tokens_per_topic": round(sum(tok(r, "completion_tokens") for r in single) / n, 1),
+            "wall_ms_per_topic": round(single_ms / n, 1),
+            "all_valid": all(r.get("validation", {}).get("ok") for r in single),
+        },
+        "packed": {
+            "prompt_tokens_per_topic": packed["packing"]["avg_prompt_tokens_per_topic"],
+            "completion_tokens_per_topic": packed["packing"]["avg_completion_tokens_per_topic"],
+            "wall_ms_per_topic": round(packed_ms / n, 1),
+            "packs": packed["packing"]["packs"],
+            "generation_calls": packed["packing"]["generation_calls"],
+            "all_valid": all(d.get("validation", {}).get("ok") for d in packed["documents"]),
+        },
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
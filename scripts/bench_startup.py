@@ -0,0 +1,90 @@
+"""
+Cold-start benchmark for api/index.py: module import + first request, in fresh interpreters.
+
+A local OpenAI-compatible stub answers chat completions instantly, so the numbers
+reflect only our own startup cost (imports, regex compilation, client creation).
+Both client paths are measured: the openai SDK and OPENAI_HTTP_MODE=direct.
+
+Usage:
+  python scripts/bench_startup.py            # 5 cold starts per mode
+  python scripts/bench_startup.py --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+CHILD = r"""
+import json, sys, threading, time, urllib.request
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+t1 = time.perf_counter()
+from http.server import HTTPServer
+srv = HTTPServer(("127.0.0.1", 0), index.handler)
+threading.Thread(target=srv.serve_forever, daemon=True).start()
+req = urllib.request.Request(f"http://127.0.0.1:{srv.server_port}/api/index",
+                             data=json.dumps({"prompt": "Say hello."}).encode(),
+                             headers={"Content-Type": "application/json"}, method="POST")
+with urllib.request.urlopen(req) as r:
+    assert json.loads(r.read())["content"]
+t2 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_request_ms": (t2 - t1) * 1000}))
+"""
+
+
+class _StubUpstream(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        body = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "<p>hello</p>"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(mode: str, runs: int, base_url: str):
+    env = dict(os.environ, OPENAI_API_KEY="bench", OPENAI_BASE_URL=base_url, OPENAI_HTTP_MODE=mode)
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", CHILD, API_DIR], env=env,
+                             capture_output=True, text=True, check=True)
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    med = lambda key: round(statistics.median(s[key] for s in samples), 1)
+    return {"mode": mode, "runs": runs, "import_ms": med("import_ms"),
+            "first_request_ms": med("first_request_ms"),
+            "total_ms": round(med("import_ms") + med("first_request_ms"), 1)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Measure import + first-request time of the API function.")
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    stub = HTTPServer(("127.0.0.1", 0), _StubUpstream)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{stub.server_port}/v1"
+    try:
+        results = [measure(mode, args.runs, base_url) for mode in ("sdk", "direct")]
+    finally:
+        stub.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
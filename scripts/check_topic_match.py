@@ -0,0 +1,60 @@
+"""
+Check the topic-cache matching rule (api/index.py) against known topic pairs.
+
+Pairs that name the same document must reach TOPIC_MATCH_THRESHOLD (so they are served, or
+offered for confirmation, from the cache); pairs that name different documents must stay below it.
+Prints every pair with its similarity and exits non-zero when any pair lands on the wrong side.
+
+Usage:
+  python scripts/check_topic_match.py
+  TOPIC_MATCH_THRESHOLD=0.75 python scripts/check_topic_match.py
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index as vocab  # noqa: E402  (api/index.py)
+
+# Same document: case and spacing, plural/singular, articles, accents, a narrower/wider wording, typos
+SAME = [
+    ("Pool equipment", "pool equipment "),
+    ("Pool equipment", "Swimming pool equipment"),
+    ("Pool equipment", "Pool equipments"),
+    ("Pool equipment", "Pool equipmnt"),
+    ("Swimming pool", "Swiming pool"),
+    ("At the pool", "Pool"),
+    ("Lakes", "Lake"),
+    ("Classes", "Class"),
+    ("Cities", "City"),
+    ("La playa", "Playas"),
+    ("Café", "Cafe"),
+]
+# Different documents that merely share letters
+DIFFERENT = [
+    ("Beach", "Bleach"),
+    ("Car repair", "Car rental"),
+    ("Bank", "Banking"),
+    ("Pool equipment", "Gym equipment"),
+    ("Pool", "Pool party"),
+    ("Pool", "School"),
+    ("Glass", "Gas"),
+]
+
+
+def main() -> int:
+    threshold = vocab.TOPIC_MATCH_THRESHOLD
+    rows, failures = [], []
+    for expect_match, pairs in ((True, SAME), (False, DIFFERENT)):
+        for a, b in pairs:
+            score = vocab.topic_similarity(a, b)
+            rows.append({"a": a, "b": b, "similarity": round(score, 3), "expect_match": expect_match})
+            if (score >= threshold) != expect_match:
+                failures.append(f"{a!r} vs {b!r}: {score:.3f} is {'below' if expect_match else 'at/above'} {threshold}")
+    print(json.dumps({"threshold": threshold, "pairs": rows, "failures": failures}, indent=2, ensure_ascii=False))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
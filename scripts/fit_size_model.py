@@ -0,0 +1,103 @@
+"""
+Fit the output-size model (SIZE_MODEL) from logged usage.
+
+The API prints one line per first generation:
+  SIZE_SAMPLE {"features": {"n": 12, ...}, "completion_tokens": 2310, "predicted_tokens": 2100}
+This script collects those lines from log files (or stdin), fits
+completion_tokens ≈ base + Σ coef × feature by ridge-regularized least squares,
+and prints the JSON to deploy as the SIZE_MODEL environment variable, plus the
+mean absolute percentage error of the current and the fitted model.
+
+Usage:
+  vercel logs <deployment> | python scripts/fit_size_model.py
+  python scripts/fit_size_model.py logs/*.txt --ridge 0.5
+"""
+import argparse
+import fileinput
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index as vocab  # noqa: E402  (api/index.py)
+
+MARKER = "SIZE_SAMPLE "
+
+
+def read_samples(paths):
+    samples = []
+    for line in fileinput.input(paths or ("-",)):
+        i = line.find(MARKER)
+        if i < 0:
+            continue
+        try:
+            rec = json.loads(line[i + len(MARKER):])
+        except json.JSONDecodeError:
+            continue
+        if rec.get("completion_tokens"):
+            samples.append(rec)
+    return samples
+
+
+def _solve(a, b):
+    """Gaussian elimination with partial pivoting (a is square, small)."""
+    n = len(a)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        piv = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[piv] = m[piv], m[col]
+        if abs(m[col][col]) < 1e-12:
+            continue
+        for r in range(n):
+            if r != col:
+                f = m[r][col] / m[col][col]
+                m[r] = [x - f * y for x, y in zip(m[r], m[col])]
+    return [m[i][n] / m[i][i] if abs(m[i][i]) >= 1e-12 else 0.0 for i in range(n)]
+
+
+def fit(samples, ridge: float):
+    keys = ("base",) + vocab.SIZE_FEATURES
+    rows = [[1.0] + [float(s["features"].get(k, 0)) for k in vocab.SIZE_FEATURES] for s in samples]
+    ys = [float(s["completion_tokens"]) for s in samples]
+    k = len(keys)
+    xtx = [[sum(r[i] * r[j] for r in rows) + (ridge if i == j and i else 0.0) for j in range(k)] for i in range(k)]
+    xty = [sum(r[i] * y for r, y in zip(rows, ys)) for i in range(k)]
+    coefs = _solve(xtx, xty)
+    # Unused sections (all-zero columns) keep their current coefficient instead of collapsing to 0
+    current = vocab.SIZE_MODEL
+    return {key: round(c, 2) if any(r[i] for r in rows) else current[key] for i, (key, c) in enumerate(zip(keys, coefs))}
+
+
+def mape(model, samples):
+    errs = []
+    for s in samples:
+        pred = model["base"] + sum(model[k] * s["features"].get(k, 0) for k in vocab.SIZE_FEATURES)
+        errs.append(abs(pred - s["completion_tokens"]) / s["completion_tokens"])
+    return round(100 * sum(errs) / len(errs), 1)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fit SIZE_MODEL coefficients from SIZE_SAMPLE log lines.")
+    ap.add_argument("logs", nargs="*", help="log files (default: stdin)")
+    ap.add_argument("--ridge", type=float, default=1.0, help="L2 penalty on per-item coefficients")
+    ap.add_argument("--min-samples", type=int, default=10)
+    args = ap.parse_args(argv)
+
+    samples = read_samples(args.logs)
+    if len(samples) < args.min_samples:
+        print(f"Only {len(samples)} samples; need at least {args.min_samples}.", file=sys.stderr)
+        return 1
+    current = vocab.SIZE_MODEL
+    fitted = fit(samples, args.ridge)
+    print(json.dumps({
+        "samples": len(samples),
+        "mape_current_pct": mape(current, samples),
+        "mape_fitted_pct": mape(fitted, samples),
+        "SIZE_MODEL": fitted,
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Offline re-normalization and audit of archived vocabulary documents.
+
+Runs the same color normalization the API applies (verbs, adverbs, nouns) and the
+per-section count verification over a directory of stored HTML, in a process pool.
+Files are discovered lazily and handed to workers by path, so memory stays flat
+no matter how many documents the archive holds.
+
+Usage:
+  python scripts/renormalize.py ARCHIVE_DIR --in-place
+  python scripts/renormalize.py ARCHIVE_DIR --out NEW_DIR --range 60-85 --report report.json
+  python scripts/renormalize.py ARCHIVE_DIR --dry-run        # audit only, write nothing
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index as vocab  # noqa: E402  (api/index.py)
+
+ALL_SECTIONS = [sel for sel, _key, _rx, _title in vocab._RESIZABLE_SECTIONS]
+MAX_LISTED_FAILURES = 200
+
+# Per-worker settings, installed once by the pool initializer
+_CFG = {}
+
+
+def iter_html_files(root: str, suffixes=(".html", ".htm")):
+    """Yield file paths under root without building the full listing in memory."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(suffixes):
+                    yield entry.path
+
+
+def detect_sections(html: str) -> set:
+    """Stored documents carry no prompt, so the selection is whatever sections are present."""
+    return {sel for sel, _key, rx, _title in vocab._RESIZABLE_SECTIONS if vocab._extract_section_body(html, rx)}
+
+
+def _init_worker(cfg):
+    _CFG.update(cfg)
+
+
+def process_file(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            original = f.read()
+        html = vocab.normalize_highlights(original)
+        changed = html != original
+
+        selected = detect_sections(html)
+        result = {"path": path, "changed": changed, "sections": sorted(selected)}
+        if _CFG.get("range"):
+            targets = vocab.VocabTargets(*_CFG["range"], selected)
+            report = vocab.build_validation_report(html, targets.quotas, targets.rows_minmax, selected)
+            result["ok"] = report["ok"]
+            result["failing"] = sorted(k for k, s in report["sections"].items() if not s["ok"])
+            result["distinct_words"] = report["distinct_words"]["total"]
+        else:
+            result["distinct_words"] = vocab.distinct_es_words(html, selected)["total"]
+
+        if not _CFG.get("dry_run") and (changed or _CFG.get("out")):
+            dest = path
+            if _CFG.get("out"):
+                dest = os.path.join(_CFG["out"], os.path.relpath(path, _CFG["src"]))
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+            vocab._write_atomic(dest, html)
+        return result
+    except Exception as e:
+        return {"path": path, "error": str(e)}
+
+
+def run(src: str, out=None, workers=None, vocab_range=None, dry_run=False, chunksize=64) -> dict:
+    cfg = {"src": os.path.abspath(src), "out": os.path.abspath(out) if out else None,
+           "range": vocab_range, "dry_run": dry_run}
+    agg = {
+        "files": 0, "changed": 0, "errors": 0, "compliant": 0, "non_compliant": 0,
+        "failing_sections": {s: 0 for s in ALL_SECTIONS},
+        "distinct_words_total": 0,
+        "non_compliant_files": [], "error_files": [],
+    }
+    started = time.perf_counter()
+    with Pool(processes=workers, initializer=_init_worker, initargs=(cfg,)) as pool:
+        for res in pool.imap_unordered(process_file, iter_html_files(cfg["src"]), chunksize=chunksize):
+            agg["files"] += 1
+            if "error" in res:
+                agg["errors"] += 1
+                if len(agg["error_files"]) < MAX_LISTED_FAILURES:
+                    agg["error_files"].append({"path": res["path"], "error": res["error"]})
+                continue
+            agg["changed"] += res["changed"]
+            agg["distinct_words_total"] += res.get("distinct_words", 0)
+            if "ok" in res:
+                if res["ok"]:
+                    agg["compliant"] += 1
+                else:
+                    agg["non_compliant"] += 1
+                    for sec in res["failing"]:
+                        agg["failing_sections"][sec] += 1
+                    if len(agg["non_compliant_files"]) < MAX_LISTED_FAILURES:
+                        agg["non_compliant_files"].append({"path": res["path"], "failing": res["failing"]})
+
+    elapsed = time.perf_counter() - started
+    agg["elapsed_s"] = round(elapsed, 2)
+    agg["files_per_s"] = round(agg["files"] / elapsed, 1) if elapsed else None
+    if not vocab_range:
+        # Compliance needs quotas, which only a known range provides
+        for k in ("compliant", "non_compliant", "failing_sections", "non_compliant_files"):
+            agg.pop(k)
+    return agg
+
+
+def _parse_range(text: str):
+    lo, _, hi = text.partition("-")
+    lo, hi = int(lo), int(hi or lo)
+    return (min(lo, hi), max(lo, hi))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Re-normalize and audit archived vocabulary HTML documents.")
+    ap.add_argument("src", help="directory of stored HTML documents (searched recursively)")
+    dest = ap.add_mutually_exclusive_group(required=True)
+    dest.add_argument("--in-place", action="store_true", help="rewrite changed files in place")
+    dest.add_argument("--out", help="write every normalized file to this directory (same relative layout)")
+    dest.add_argument("--dry-run", action="store_true", help="audit only; write nothing")
+    ap.add_argument("--range", type=_parse_range, help="vocabulary range LO-HI the documents were generated for")
+    ap.add_argument("--workers", type=int, default=None, help="process count (default: CPU count)")
+    ap.add_argument("--chunksize", type=int, default=64, help="files handed to a worker per batch")
+    ap.add_argument("--report", help="write the aggregate JSON report here instead of stdout")
+    args = ap.parse_args(argv)
+
+    report = run(args.src, out=args.out, workers=args.workers, vocab_range=args.range,
+                 dry_run=args.dry_run, chunksize=args.chunksize)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())